@@ -0,0 +1,235 @@
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+# Galleries with fewer identities than this are matched exactly with a dense matmul
+ANN_MIN_SIZE = 5000
+ANN_DEFAULT_NPROBE = 8      # Inverted lists scanned per query (higher = better recall, slower)
+ANN_TRAIN_ITERATIONS = 10
+ANN_MAX_TRAIN_SAMPLES = 256  # Per inverted list, when training the coarse quantizer
+
+_save_lock = threading.Lock()  # Serializes index saves across index copies
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index for unit vectors.
+
+    Vectors are assigned to the nearest of `nlist` coarse centroids (trained
+    with spherical k-means). A query only scans the `nprobe` closest lists, so
+    `nprobe` is the recall/latency knob. Keys can be inserted and removed
+    without retraining.
+    """
+    exact = False
+
+    def __init__(self, dim, nlist, nprobe=ANN_DEFAULT_NPROBE):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.coarse_centroids = np.zeros((0, dim), dtype=np.float32)
+        self.list_vectors = [np.zeros((0, dim), dtype=np.float32) for _ in range(nlist)]
+        self.list_keys = [[] for _ in range(nlist)]
+        self.key_to_list = {}
+        self.version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.key_to_list)
+
+    def set_nprobe(self, nprobe):
+        """Set how many inverted lists are scanned per query"""
+        self.nprobe = max(1, min(int(nprobe), self.nlist))
+
+    def train(self, vectors, iterations=ANN_TRAIN_ITERATIONS, seed=0):
+        """Train the coarse quantizer with spherical k-means"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        max_samples = self.nlist * ANN_MAX_TRAIN_SAMPLES
+        if len(vectors) > max_samples:
+            vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+
+        centroids = vectors[rng.choice(len(vectors), self.nlist, replace=len(vectors) < self.nlist)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Keep the previous centroid for lists that received no vectors
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+        self.coarse_centroids = centroids.astype(np.float32)
+
+    def copy(self):
+        """Copy the index for a new gallery snapshot; the inverted lists are shared until replaced"""
+        with self._lock:
+            index = IVFIndex(self.dim, self.nlist, self.nprobe)
+            index.coarse_centroids = self.coarse_centroids
+            index.list_vectors = list(self.list_vectors)
+            index.list_keys = list(self.list_keys)
+            index.key_to_list = dict(self.key_to_list)
+        return index
+
+    def add(self, keys, vectors):
+        """Insert (or replace) vectors under the given keys"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            self._remove_locked(keys)
+            assignments = np.argmax(vectors @ self.coarse_centroids.T, axis=1)
+            for list_id in np.unique(assignments):
+                rows = np.flatnonzero(assignments == list_id)
+                # Lists are replaced rather than extended in place, so copies can share them
+                self.list_vectors[list_id] = np.vstack([self.list_vectors[list_id], vectors[rows]])
+                self.list_keys[list_id] = self.list_keys[list_id] + [keys[row] for row in rows]
+                for row in rows:
+                    self.key_to_list[keys[row]] = int(list_id)
+
+    def remove(self, keys):
+        """Delete the given keys from the index (unknown keys are ignored)"""
+        with self._lock:
+            self._remove_locked(keys)
+
+    def _remove_locked(self, keys):
+        by_list = {}
+        for key in keys:
+            list_id = self.key_to_list.pop(key, None)
+            if list_id is not None:
+                by_list.setdefault(list_id, set()).add(key)
+        for list_id, removed in by_list.items():
+            keep = [i for i, key in enumerate(self.list_keys[list_id]) if key not in removed]
+            self.list_vectors[list_id] = self.list_vectors[list_id][keep]
+            self.list_keys[list_id] = [self.list_keys[list_id][i] for i in keep]
+
+    def search(self, queries, k, nprobe=None):
+        """Return the top-k (keys, scores) for each query"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        results = []
+        with self._lock:
+            coarse_scores = queries @ self.coarse_centroids.T
+            probe_lists = np.argpartition(-coarse_scores, nprobe - 1, axis=1)[:, :nprobe]
+            for query, lists in zip(queries, probe_lists):
+                candidate_keys = []
+                candidate_vectors = []
+                for list_id in lists:
+                    if self.list_keys[list_id]:
+                        candidate_keys.extend(self.list_keys[list_id])
+                        candidate_vectors.append(self.list_vectors[list_id])
+                if not candidate_keys:
+                    results.append(([], np.zeros(0, dtype=np.float32)))
+                    continue
+                scores = np.concatenate(candidate_vectors) @ query
+                top = min(k, len(scores))
+                best = np.argpartition(-scores, top - 1)[:top]
+                best = best[np.argsort(-scores[best])]
+                results.append(([candidate_keys[i] for i in best], scores[best]))
+        return results
+
+    def evaluate(self, queries, k=1, nprobe_values=(1, 2, 4, 8, 16, 32)):
+        """Report recall@k against an exact scan and mean latency for each nprobe setting"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        with self._lock:
+            all_keys = [key for keys in self.list_keys for key in keys]
+            all_vectors = np.concatenate(self.list_vectors)
+        exact_scores = queries @ all_vectors.T
+        exact_top = np.argsort(-exact_scores, axis=1)[:, :k]
+        exact_keys = [set(all_keys[i] for i in row) for row in exact_top]
+
+        report = []
+        for nprobe in nprobe_values:
+            if nprobe > self.nlist:
+                break
+            start_time = time.perf_counter()
+            results = self.search(queries, k, nprobe=nprobe)
+            latency_ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+            hits = sum(len(expected & set(keys)) for expected, (keys, _) in zip(exact_keys, results))
+            report.append({
+                'nprobe': nprobe,
+                'recall': hits / max(1, sum(len(expected) for expected in exact_keys)),
+                'latency_ms': latency_ms
+            })
+        return report
+
+    def arrays(self):
+        """Return (coarse_centroids, vectors, list_offsets, keys): the inverted lists laid end to end"""
+        with self._lock:
+            vectors = np.concatenate(self.list_vectors)
+            list_offsets = np.cumsum([0] + [len(list_keys) for list_keys in self.list_keys]).astype(np.int64)
+            keys = [key for list_keys in self.list_keys for key in list_keys]
+        return self.coarse_centroids, vectors, list_offsets, keys
+
+    @classmethod
+    def from_arrays(cls, coarse_centroids, vectors, list_offsets, keys, nprobe=ANN_DEFAULT_NPROBE):
+        """Rebuild an index from arrays(); the inverted lists are views of vectors, not copies"""
+        index = cls(coarse_centroids.shape[1], coarse_centroids.shape[0], nprobe)
+        index.coarse_centroids = coarse_centroids
+        for list_id in range(index.nlist):
+            start, end = int(list_offsets[list_id]), int(list_offsets[list_id + 1])
+            index.list_vectors[list_id] = vectors[start:end]
+            index.list_keys[list_id] = keys[start:end]
+            for key in index.list_keys[list_id]:
+                index.key_to_list[key] = list_id
+        return index
+
+    def save(self, path, version):
+        """Persist the index, tagged with the gallery version it was built for"""
+        with self._lock:
+            keys = [key for list_keys in self.list_keys for key in list_keys]
+            list_ids = np.concatenate([np.full(len(list_keys), i, dtype=np.int32)
+                                       for i, list_keys in enumerate(self.list_keys)])
+            vectors = np.concatenate(self.list_vectors)
+        # Copies of an index have their own locks, so saves to one path are serialized
+        # here and each writes its own temp file
+        with _save_lock:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                            prefix=os.path.basename(path) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f,
+                             coarse_centroids=self.coarse_centroids,
+                             vectors=vectors,
+                             list_ids=list_ids,
+                             keys=np.array(keys, dtype=object),
+                             nprobe=np.int32(self.nprobe),
+                             version=np.array(version))
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self.version = version
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save()"""
+        data = np.load(path, allow_pickle=True)
+        coarse_centroids = data['coarse_centroids']
+        index = cls(coarse_centroids.shape[1], coarse_centroids.shape[0], int(data['nprobe']))
+        index.coarse_centroids = coarse_centroids
+        vectors = data['vectors']
+        list_ids = data['list_ids']
+        keys = list(data['keys'])
+        for list_id in range(index.nlist):
+            rows = np.flatnonzero(list_ids == list_id)
+            index.list_vectors[list_id] = vectors[rows]
+            index.list_keys[list_id] = [keys[i] for i in rows]
+            for i in rows:
+                index.key_to_list[keys[i]] = list_id
+        index.version = str(data['version'])
+        return index
+
+
+# Function to build an ANN index for a gallery, or None when exact matching is cheap enough
+def build_index(keys, vectors, min_size=ANN_MIN_SIZE):
+    if len(keys) < min_size:
+        return None
+    vectors = np.asarray(vectors, dtype=np.float32)
+    nlist = max(1, int(4 * np.sqrt(len(keys))))
+    index = IVFIndex(vectors.shape[1], nlist)
+    index.train(vectors)
+    index.add(list(keys), vectors)
+    return index
+
+
+# Function to get the index file stored next to an embeddings file
+def index_path_for(embeddings_path):
+    return os.path.splitext(embeddings_path)[0] + '.ivf.npz'
@@ -1,19 +1,32 @@
-from flask import Flask, request, jsonify
+import time
+PROCESS_START_TIME = time.perf_counter()  # For the cold-start-to-first-result metric
+
+from flask import Flask, request, jsonify, Response, stream_with_context
+import json
 import cv2
 import os
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-import pickle
-import shutil
 from flask_cors import CORS
 import datetime
 from datetime import datetime  # This is the correct import
-import base64
-from scipy.spatial.distance import cosine
-import mediapipe as mp
-import time
+import threading
 from collections import Counter
+from gallery import EmbeddingGallery
+from shared_gallery import SharedGallery
+from embedding_store import EmbeddingStore
+from embedding_engine import EmbeddingEngine, EMBEDDING_BATCH_SIZE
+from batching import MicroBatcher, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from detector_pool import DetectorPool, DETECTOR_POOL_SIZE, detection_input
+from embedding_codec import (ENCODINGS, BINARY_MIMETYPE, encode_embeddings, decode_embeddings,
+                             pack_embeddings, unpack_embeddings, quantization_report)
+from matcher import FaceMatcher
+from inference_model import TFLiteFeatureModel
+from model_metadata import load_model_metadata
+from preprocessing import Preprocessor, accepts_uint8
+from face_alignment import align_face
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_FILE, model_version
+from enrollment import (EnrollmentPipeline, PIPELINE_WORKERS, PIPELINE_MAX_IN_FLIGHT,
+                        iter_ndjson_images, iter_multipart_images, decode_base64_image)
 
 
 app = Flask(__name__)
@@ -21,82 +34,90 @@ CORS(app)
 
 # Configuration
 MODEL_FOLDER = 'resnet50_model'
-FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, 'resnet50_face_features.h5')
+FEATURE_MODEL_NAME = 'resnet50'  # Model name written by ready.py, e.g. 'mobilenet_v2_160_128'
+FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, f'{FEATURE_MODEL_NAME}_face_features.h5')
+INFERENCE_MODEL_PATH = os.path.join(MODEL_FOLDER, f'{FEATURE_MODEL_NAME}_face_features.tflite')  # from `python ready.py --export`
+USE_INFERENCE_MODEL = True  # Prefer the exported TFLite model when it exists
+ACTIVE_MODEL_PATH = INFERENCE_MODEL_PATH if USE_INFERENCE_MODEL and os.path.exists(INFERENCE_MODEL_PATH) else FEATURE_MODEL_PATH
+MODEL_METADATA = load_model_metadata(ACTIVE_MODEL_PATH)  # Input size and preprocessing for the backbone
+PREPROCESS_UINT8 = True  # Feed raw uint8 pixels when the backbone normalizes inside the model
 TEMP_FACES_DIR = 'temp_faces'
-OUTPUT_FILE = 'face_embeddings.pkl'
+SAVE_RAW_IMAGES = False  # Also write uploaded enrollment images under TEMP_FACES_DIR (in the background)
+OUTPUT_FILE = 'face_embeddings.pkl'  # Legacy pickle gallery, migrated into the store once (then renamed .migrated)
+GALLERY_STORE_PATH = 'face_embeddings'  # face_embeddings.f32 (memory-mapped matrix) + face_embeddings.idx.json
+GALLERY_STORE_DTYPE = 'float32'  # or 'float16' to halve the store size
 SIMILARITY_THRESHOLD = 0.4  # Adjusted for ResNet50 (higher value means more similar)
+MULTI_FACE_MIN_CONFIDENCE = 0.5  # Detections below this score are ignored in multi-face recognition
+MULTI_FACE_DETECTION_MAX_SIDE = 1280  # Detection resolution for multi-face recognition
+SHARED_GALLERY = os.environ.get('SHARED_GALLERY') == '1'  # Set by the pre-fork worker mode (gunicorn.conf.py)
+ANN_NPROBE = 8  # Recall/latency knob of the ANN index (large galleries); see /api/ann-report
+ANN_REPORT_QUERIES = 200  # Stored embeddings used as probes by /api/ann-report
 
-# Ensure temp directory exists
-os.makedirs(TEMP_FACES_DIR, exist_ok=True)
-
-# Configure TensorFlow for better performance (optional)
-tf.config.threading.set_intra_op_parallelism_threads(4)
-tf.config.threading.set_inter_op_parallelism_threads(4)
-
-# Initialize MediaPipe Face Detection
-mp_face_detection = mp.solutions.face_detection
-mp_drawing = mp.solutions.drawing_utils
-face_detection = mp_face_detection.FaceDetection(
-    model_selection=1,  # 0=closer faces, 1=longer distance faces
-    min_detection_confidence=0.5
-)
-
-# Function to perform face alignment using eye landmarks
-def align_face(image, landmarks):
-    # Extract eye landmarks (MediaPipe provides normalized coordinates)
-    h, w, _ = image.shape
-    
-    # Convert to absolute coordinates (rough estimate from MediaPipe landmarks)
-    left_eye_x = int(landmarks.location_data.relative_keypoints[0].x * w)
-    left_eye_y = int(landmarks.location_data.relative_keypoints[0].y * h)
-    right_eye_x = int(landmarks.location_data.relative_keypoints[1].x * w)
-    right_eye_y = int(landmarks.location_data.relative_keypoints[1].y * h)
-    
-    # Calculate angle
-    dx = right_eye_x - left_eye_x
-    dy = right_eye_y - left_eye_y
-    angle = np.degrees(np.arctan2(dy, dx))
-    
-    # Get rotation matrix
-    center = ((left_eye_x + right_eye_x) // 2, (left_eye_y + right_eye_y) // 2)
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, scale=1.0)
-    
-    # Apply rotation
-    aligned_image = cv2.warpAffine(image, rotation_matrix, (w, h), flags=cv2.INTER_CUBIC)
-    
-    return aligned_image
-
-# Function to preprocess image for ResNet50 model
-def preprocess_image(img):
-    # Resize to 224x224 (ResNet input size)
-    resized = cv2.resize(img, (224, 224))
-    # Convert from BGR to RGB (OpenCV uses BGR, but model expects RGB)
-    rgb_img = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    
-    # Convert to float32 BEFORE subtraction
-    bgr_img = rgb_img[..., ::-1].copy().astype(np.float32)
-    
-    # Zero-center by mean pixel values
-    bgr_img[..., 0] -= 91.4953
-    bgr_img[..., 1] -= 103.8827
-    bgr_img[..., 2] -= 131.0912
-    
-    # Add batch dimension
-    preprocessed = np.expand_dims(bgr_img, axis=0)
-    return preprocessed
+# Server-side embedding gallery (filled by /api/process-images, persisted in the memory-mapped store).
+# In the pre-fork worker mode it lives in shared memory, created here in the parent before forking.
+gallery = EmbeddingGallery(store=EmbeddingStore(GALLERY_STORE_PATH,
+                                                model_version=model_version(ACTIVE_MODEL_PATH),
+                                                dtype=GALLERY_STORE_DTYPE),
+                           shared=SharedGallery.create() if SHARED_GALLERY else None,
+                           nprobe=ANN_NPROBE)
+try:
+    if gallery.load_store():
+        print(f"Loaded embedding gallery {gallery.version} from {GALLERY_STORE_PATH}")
+    elif gallery.load_file(OUTPUT_FILE):
+        print(f"Migrated embedding gallery {gallery.version} from {OUTPUT_FILE} to {GALLERY_STORE_PATH}")
+except Exception as e:
+    print(f"Warning: Could not load embedding gallery: {e}")
+
+PRELOAD_MODEL = True  # Load and warm up the model in the background as soon as the server starts
+TF_INTRA_OP_THREADS = 4
+TF_INTER_OP_THREADS = 4
+
+# Function to pin this worker process to a subset of cores (pre-fork worker mode).
+# Must run before the model is loaded so TensorFlow sizes its thread pools to match.
+def pin_worker_to_cores(cores):
+    global TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS
+    os.sched_setaffinity(0, cores)
+    TF_INTRA_OP_THREADS = len(cores)
+    TF_INTER_OP_THREADS = min(2, len(cores))
+    cv2.setNumThreads(len(cores))
+
+# Startup progress, reported by /api/ready
+startup_state = {
+    "phase": "not-started",
+    "ready": False,
+    "timings": {},
+    "firstResultSeconds": None,
+    "error": None
+}
+
+# Lock for lazily created models/engines (TensorFlow and MediaPipe are only
+# imported when they are first needed)
+_lazy_init_lock = threading.RLock()
 
-# Function to extract face embeddings using ResNet50 model
-def extract_resnet_features(face_img, resnet_feature_model):
-    preprocessed = preprocess_image(face_img)
-    features = resnet_feature_model.predict(preprocessed, verbose=0)
-    return features[0]  # Return the feature vector
+# Pool of MediaPipe Face Detection graphs (one checked out per request)
+_detector_pool = None
+def get_detector_pool():
+    global _detector_pool
+    with _lazy_init_lock:
+        if _detector_pool is None:
+            _detector_pool = DetectorPool(
+                size=DETECTOR_POOL_SIZE,
+                model_selection=1,  # 0=closer faces, 1=longer distance faces
+                min_detection_confidence=0.5
+            )
+    return _detector_pool
+
+# Preprocessing for the feature model (input size and normalization from MODEL_METADATA).
+# Backbones with normalization built in take raw uint8 batches, a quarter of the bytes.
+PREPROCESS_DTYPE = np.uint8 if PREPROCESS_UINT8 and accepts_uint8(MODEL_METADATA) else np.float32
+preprocess_image = Preprocessor(MODEL_METADATA, dtype=PREPROCESS_DTYPE)
 
 # Function to detect face using MediaPipe and return cropped face
 def detect_and_crop_face(image):
-    # Convert the BGR image to RGB
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    # Convert the BGR image to a downscaled RGB copy for detection; cropping uses the full image
+    rgb_image = detection_input(image)
     # Process the image
-    results = face_detection.process(rgb_image)
+    results = get_detector_pool().process(rgb_image)
     
     if not results.detections:
         return None, None
@@ -121,35 +142,27 @@ def detect_and_crop_face(image):
     # Crop the face
     face_img = image[y:y+h, x:x+w]
     
-    # Try to align the face if landmarks are available
-    try:
-        aligned_face = align_face(image, detection)
-        # Re-crop the aligned face using the same boundaries
-        aligned_face_crop = aligned_face[y:y+h, x:x+w]
-        if aligned_face_crop.size > 0:
-            face_img = aligned_face_crop
-    except Exception as e:
-        print(f"Warning: Face alignment failed: {e}")
+    # Try to align the face if landmarks are available: rotate, crop and resize to
+    # the model input size in one warp over the output pixels only
+    if face_img.size > 0:
+        try:
+            face_img = align_face(image, detection, (x, y, w, h), MODEL_METADATA['input_size'])
+        except Exception as e:
+            print(f"Warning: Face alignment failed: {e}")
     
     return face_img, (x, y, w, h)
 
 # Function to detect face in an image (for validation only)
 def detect_face(image_data):
     try:
-        # Convert base64 to image
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]  # Remove data URL prefix
-        
-        image_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        # Convert base64 to image (large JPEGs are decoded at reduced scale)
+        img, _ = decode_base64_image(image_data)
         
         if img is None:
             return False, "Failed to decode image"
         
         # Detect face using MediaPipe instead of Haar cascade
-        rgb_image = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        results = face_detection.process(rgb_image)
+        results = get_detector_pool().process(detection_input(img))
         
         if not results.detections:
             return False, "No face detected in the image"
@@ -190,16 +203,118 @@ def detect_face(image_data):
 _resnet_model = None
 def get_resnet_model():
     global _resnet_model
-    if _resnet_model is None:
-        print("Loading ResNet50 Face feature extraction model...")
-        try:
-            _resnet_model = load_model(FEATURE_MODEL_PATH)
-            print("Model loaded successfully!")
-        except Exception as e:
-            print(f"Error loading model: {str(e)}")
-            _resnet_model = None
+    with _lazy_init_lock:
+        if _resnet_model is None:
+            print(f"Loading ResNet50 Face feature extraction model from {ACTIVE_MODEL_PATH}...")
+            try:
+                if ACTIVE_MODEL_PATH.endswith('.tflite'):
+                    _resnet_model = TFLiteFeatureModel(ACTIVE_MODEL_PATH, num_threads=TF_INTRA_OP_THREADS)
+                else:
+                    import tensorflow as tf
+                    from tensorflow.keras.models import load_model
+                    
+                    # Configure TensorFlow for better performance (optional)
+                    tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+                    tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+                    _resnet_model = load_model(ACTIVE_MODEL_PATH)
+                print("Model loaded successfully!")
+            except Exception as e:
+                print(f"Error loading model: {str(e)}")
+                _resnet_model = None
     return _resnet_model
 
+# Batched embedding engine wrapping the ResNet50 model (created on first use)
+_embedding_engine = None
+def get_embedding_engine():
+    global _embedding_engine
+    with _lazy_init_lock:
+        if _embedding_engine is None:
+            resnet_feature_model = get_resnet_model()
+            if resnet_feature_model is None:
+                return None
+            _embedding_engine = EmbeddingEngine(resnet_feature_model, preprocess_image,
+                                                batch_size=EMBEDDING_BATCH_SIZE)
+    return _embedding_engine
+
+# Micro-batching scheduler shared by concurrent recognition requests
+_micro_batcher = None
+def get_micro_batcher():
+    global _micro_batcher
+    with _lazy_init_lock:
+        if _micro_batcher is None:
+            resnet_feature_model = get_resnet_model()
+            if resnet_feature_model is None:
+                return None
+            engine = EmbeddingEngine(resnet_feature_model, preprocess_image, batch_size=BATCH_MAX_SIZE)
+            _micro_batcher = MicroBatcher(engine, max_batch_size=BATCH_MAX_SIZE,
+                                          max_wait_ms=BATCH_MAX_WAIT_MS)
+    return _micro_batcher
+
+# Pipelined enrollment engine (parallel decode/detect/preprocess + batched embedding)
+_enrollment_pipeline = None
+def get_enrollment_pipeline():
+    global _enrollment_pipeline
+    with _lazy_init_lock:
+        if _enrollment_pipeline is None:
+            embedding_engine = get_embedding_engine()
+            if embedding_engine is None:
+                return None
+            embedding_cache = EmbeddingCache(EMBEDDING_CACHE_FILE, version=model_version(ACTIVE_MODEL_PATH))
+            _enrollment_pipeline = EnrollmentPipeline(embedding_engine, detect_and_crop_face,
+                                                      workers=PIPELINE_WORKERS,
+                                                      max_in_flight=PIPELINE_MAX_IN_FLIGHT,
+                                                      cache=embedding_cache)
+    return _enrollment_pipeline
+
+# Function to record the cold-start-to-first-result time (once per process)
+def record_first_result():
+    if startup_state["firstResultSeconds"] is None:
+        startup_state["firstResultSeconds"] = time.perf_counter() - PROCESS_START_TIME
+        print(f"Cold start to first result: {startup_state['firstResultSeconds']:.2f}s")
+
+# Function to run the startup phase: load the model, then warm up every engine
+# at each of its bucket batch sizes so the first real request pays no tracing cost
+def run_startup():
+    def timed(phase, fn):
+        startup_state["phase"] = phase
+        start_time = time.perf_counter()
+        result = fn()
+        startup_state["timings"][phase] = time.perf_counter() - start_time
+        return result
+    
+    try:
+        timed("detector-pool", lambda: [get_detector_pool().process(np.zeros((64, 64, 3), dtype=np.uint8))
+                                        for _ in range(DETECTOR_POOL_SIZE)])
+        if timed("model-load", get_resnet_model) is None:
+            raise RuntimeError("Failed to load ResNet50 model")
+        
+        enrollment_engine = get_enrollment_pipeline().engine
+        timed(f"warmup-batch-{enrollment_engine.batch_size}", enrollment_engine.warm_up)
+        recognition_engine = get_micro_batcher().engine
+        timed(f"warmup-batch-{recognition_engine.batch_size}", recognition_engine.warm_up)
+        
+        startup_state["phase"] = "ready"
+        startup_state["ready"] = True
+        startup_state["timings"]["coldStartToReady"] = time.perf_counter() - PROCESS_START_TIME
+        print(f"Startup complete in {startup_state['timings']['coldStartToReady']:.2f}s")
+    except Exception as e:
+        startup_state["phase"] = "failed"
+        startup_state["error"] = str(e)
+        print(f"Startup error: {str(e)}")
+
+# Function to run the startup phase without blocking the server
+def start_background_startup():
+    thread = threading.Thread(target=run_startup, name="startup", daemon=True)
+    thread.start()
+    return thread
+
+# Function to finish the embedding batches and cache write already queued before the process exits
+def shutdown_services(timeout=None):
+    if _micro_batcher is not None:
+        _micro_batcher.close(timeout)
+    if _enrollment_pipeline is not None and _enrollment_pipeline.cache is not None:
+        _enrollment_pipeline.cache.flush(timeout)
+
 @app.route('/api/process-images', methods=['POST'])
 def process_images():
     try:
@@ -210,105 +325,72 @@ def process_images():
         if not images:
             return jsonify({"error": "No images provided"}), 400
         
+        # Embeddings come back as JSON lists unless a compact encoding is requested
+        # (?encoding=f16|int8, or Accept: application/octet-stream for raw binary)
+        encoding = request.args.get('encoding', 'json')
+        binary_response = request.accept_mimetypes.best == BINARY_MIMETYPE
+        if encoding not in ENCODINGS:
+            return jsonify({"error": f"Unsupported encoding: {encoding}"}), 400
+        
         # Load ResNet50 model
-        resnet_feature_model = get_resnet_model()
-        if resnet_feature_model is None:
+        enrollment_pipeline = get_enrollment_pipeline()
+        if enrollment_pipeline is None:
             return jsonify({"error": "Failed to load ResNet50 model"}), 500
         
-        # Clear temp directory
-        if os.path.exists(TEMP_FACES_DIR):
-            shutil.rmtree(TEMP_FACES_DIR)
-        os.makedirs(TEMP_FACES_DIR, exist_ok=True)
-        
-        # Save images to temp directory
         logs = ["Starting image processing with ResNet50 model..."]
         
-        # Group images by person name
-        person_images = {}
-        for img_data in images:
-            person_name = img_data.get('personName')
-            if person_name not in person_images:
-                person_images[person_name] = []
-            person_images[person_name].append(img_data)
-        
-        logs.append(f"Found images for {len(person_images)} users")
-        
-        # Save images grouped by person
-        for person_name, person_img_list in person_images.items():
-            person_dir = os.path.join(TEMP_FACES_DIR, person_name)
-            os.makedirs(person_dir, exist_ok=True)
-            
-            logs.append(f"Saving {len(person_img_list)} images for {person_name}")
-            
-            for img_data in person_img_list:
-                image_name = img_data.get('imageName')
-                image_base64 = img_data.get('imageData')
-                
-                # Handle different base64 formats
-                if ',' in image_base64:
-                    image_base64 = image_base64.split(',')[1]  # Remove data URL prefix
-                
-                # Convert base64 to image and save
-                image_bytes = base64.b64decode(image_base64)
-                img_path = os.path.join(person_dir, image_name)
-                with open(img_path, 'wb') as f:
-                    f.write(image_bytes)
-                
-                logs.append(f"  Saved image: {image_name} for person: {person_name}")
+        # Count images per person name
+        person_counts = Counter(img_data.get('personName') for img_data in images)
+        logs.append(f"Found images for {len(person_counts)} users")
         
         # Process images with ResNet50 model
         logs.append("Processing images with ResNet50 model...")
         
-        # Process each person's directory
-        embeddings_data = {}
-        
-        for person_name in os.listdir(TEMP_FACES_DIR):
-            person_path = os.path.join(TEMP_FACES_DIR, person_name)
-            if os.path.isdir(person_path):
-                embeddings_data[person_name] = []
-                logs.append(f"Processing images for: {person_name}")
-                
-                # Process each image in the person's directory
-                for img_name in os.listdir(person_path):
-                    if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-                        img_path = os.path.join(person_path, img_name)
-                        try:
-                            # Load image
-                            img = cv2.imread(img_path)
-                            if img is None:
-                                logs.append(f"Could not read image: {img_path}")
-                                continue
-                            
-                            # Detect face in the image using MediaPipe
-                            face_img, face_coords = detect_and_crop_face(img)
-                            
-                            if face_img is not None and face_img.size > 0:
-                                # Extract features using ResNet50
-                                embedding = extract_resnet_features(face_img, resnet_feature_model)
-                                
-                                # Store embedding
-                                embeddings_data[person_name].append(embedding.tolist())  # Convert numpy array to list for JSON
-                                logs.append(f"  Processed: {img_name}")
-                            else:
-                                logs.append(f"  No face detected in: {img_name}")
-                        
-                        except Exception as e:
-                            logs.append(f"  Error processing {img_path}: {str(e)}")
+        # Decode, detect and preprocess images in parallel straight from the request
+        # buffer, embedding faces in batches. Raw images are only written to disk if enabled.
+        embeddings_data = {person_name: [] for person_name in person_counts}
+        save_dir = TEMP_FACES_DIR if SAVE_RAW_IMAGES else None
+        
+        run_stats = {}
+        for person_name, img_name, embedding, message in enrollment_pipeline.run(images, save_dir=save_dir,
+                                                                                 stats=run_stats):
+            if embedding is not None:
+                embeddings_data[person_name].append(embedding)
+            logs.append(message)
+        logs.append(f"Embedded faces at {run_stats['images_per_sec']:.1f} images/sec "
+                    f"(batch size {enrollment_pipeline.engine.batch_size})")
+        logs.append(f"Served {run_stats['cache_hits']} of {len(images)} images from the embedding cache")
         
         # Print summary
         total_embeddings = sum(len(emb) for emb in embeddings_data.values())
         logs.append(f"\nProcessed {total_embeddings} face images for {len(embeddings_data)} persons")
         
+        # Publish the new embeddings to the server-side gallery. With "merge" only
+        # the uploaded persons are inserted/replaced (e.g. a newly registered student)
+        if data.get('merge'):
+            gallery_version = gallery.update(embeddings_data)
+            embeddings_data = gallery.snapshot().person_rows()
+        else:
+            gallery_version = gallery.load(embeddings_data)
+        logs.append(f"Gallery updated to version {gallery_version}")
+        
         # Save embeddings to file (for backup/local use)
-        logs.append(f"Saving embeddings to {OUTPUT_FILE}...")
-        with open(OUTPUT_FILE, 'wb') as f:
-            pickle.dump(embeddings_data, f)
+        logs.append(f"Saving embeddings to {GALLERY_STORE_PATH}...")
+        gallery.save_index()
         logs.append("Embeddings saved successfully!")
         
+        record_first_result()
+        if binary_response:
+            return Response(pack_embeddings(embeddings_data, encoding), mimetype=BINARY_MIMETYPE,
+                            headers={"X-Gallery-Version": gallery_version})
+        
         # Return the embeddings and logs
         response = {
             "logs": logs,
-            "embeddings": embeddings_data,
+            "embeddings": encode_embeddings(embeddings_data, encoding),
+            "galleryVersion": gallery_version,
+            "imagesPerSec": run_stats['images_per_sec'],
+            "cacheHits": run_stats['cache_hits'],
             "timestamp": datetime.now().isoformat()  # FIXED: Changed from datetime.datetime.now()
         }
         
@@ -317,42 +399,134 @@ def process_images():
     except Exception as e:
         return jsonify({"error": f"Processing error: {str(e)}"}), 500
 
+# Streaming enrollment: images arrive as multipart parts (field name = personName,
+# filename = imageName) or as NDJSON lines of {personName, imageName, imageData}.
+# Progress and per-image results are streamed back as NDJSON events, and each
+# person's embeddings are merged into the gallery as soon as their images are done.
+@app.route('/api/process-images/stream', methods=['POST'])
+def process_images_stream():
+    enrollment_pipeline = get_enrollment_pipeline()
+    if enrollment_pipeline is None:
+        return jsonify({"error": "Failed to load ResNet50 model"}), 500
+    
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            return jsonify({"error": "Missing multipart boundary"}), 400
+        # Parsed straight off the request stream, one file part at a time
+        images = iter_multipart_images(request.stream, boundary)
+    else:
+        images = iter_ndjson_images(request.stream)
+    save_dir = TEMP_FACES_DIR if SAVE_RAW_IMAGES else None
+    
+    def generate():
+        person_embeddings = {}
+        processed = 0
+        current_person = None
+        run_stats = {}
+        
+        def commit_person(person_name):
+            # Updates only touch this person's slice, so committing one at a time stays cheap
+            gallery_version = gallery.add_person(person_name, person_embeddings[person_name])
+            return json.dumps({
+                "type": "person",
+                "personName": person_name,
+                "embeddings": len(person_embeddings[person_name]),
+                "galleryVersion": gallery_version
+            }) + "\n"
+        
+        try:
+            for person_name, img_name, embedding, message in enrollment_pipeline.run(images, save_dir=save_dir,
+                                                                                     stats=run_stats):
+                # Images arrive grouped by person; a new name means the previous person is done
+                if current_person is not None and person_name != current_person:
+                    yield commit_person(current_person)
+                current_person = person_name
+                
+                person_embeddings.setdefault(person_name, [])
+                if embedding is not None:
+                    person_embeddings[person_name].append(embedding)
+                processed += 1
+                
+                yield json.dumps({
+                    "type": "image",
+                    "personName": person_name,
+                    "imageName": img_name,
+                    "ok": embedding is not None,
+                    "message": message.strip(),
+                    "processed": processed
+                }) + "\n"
+            
+            if current_person is not None:
+                yield commit_person(current_person)
+            
+            gallery.save_index()
+            yield json.dumps({
+                "type": "done",
+                "processed": processed,
+                "persons": len(person_embeddings),
+                "galleryVersion": gallery.version,
+                "imagesPerSec": run_stats['images_per_sec'],
+                "cacheHits": run_stats['cache_hits'],
+                "timestamp": datetime.now().isoformat()
+            }) + "\n"
+        
+        except Exception as e:
+            # Persons committed so far stay in the gallery; only the one in progress is dropped
+            yield json.dumps({"type": "error", "error": f"Processing error: {str(e)}",
+                              "galleryVersion": gallery.version}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # New route for face recognition using stored embeddings
 @app.route('/api/recognize-face', methods=['POST'])
 def recognize_face():
     try:
-        # Get the image data from request
-        data = request.json
+        # Get the image data from request. A binary body carries the embeddings as a packed
+        # matrix, with the other request fields in its header
+        if request.mimetype == BINARY_MIMETYPE:
+            stored_embeddings, data = unpack_embeddings(request.get_data())
+        else:
+            data = request.json
+            stored_embeddings = data.get('embeddings')
+            if stored_embeddings:
+                stored_embeddings = decode_embeddings(stored_embeddings)
         image_data = data.get('image')
-        stored_embeddings = data.get('embeddings')
+        requested_version = data.get('galleryVersion')
         
         if not image_data:
             return jsonify({"error": "No image provided"}), 400
         
-        if not stored_embeddings:
-            return jsonify({"error": "No embeddings provided"}), 400
+        # Clients may still send the full embeddings dict to re-seed an empty gallery
+        # (e.g. after a server restart); a gallery already loaded is never replaced
+        if stored_embeddings and gallery.seed(stored_embeddings) is None:
+            return jsonify({"error": "Server gallery is already loaded",
+                            "galleryVersion": gallery.version}), 409
         
-        # Convert stored embeddings from lists back to numpy arrays
-        processed_embeddings = {}
-        for person_name, embeddings_list in stored_embeddings.items():
-            processed_embeddings[person_name] = [np.array(emb) for emb in embeddings_list]
+        snapshot = gallery.snapshot()
+        if snapshot.size == 0:
+            return jsonify({"error": "No embeddings loaded on the server",
+                            "galleryVersion": None}), 409
         
-        # Load ResNet50 model
-        resnet_feature_model = get_resnet_model()
-        if resnet_feature_model is None:
+        if requested_version and requested_version != snapshot.version:
+            return jsonify({"error": "Gallery version mismatch",
+                            "galleryVersion": snapshot.version}), 409
+        
+        # Load ResNet50 model behind the micro-batching scheduler
+        micro_batcher = get_micro_batcher()
+        if micro_batcher is None:
             return jsonify({"error": "Failed to load ResNet50 model"}), 500
         
         # Convert base64 to image
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]  # Remove data URL prefix
-        
-        image_bytes = base64.b64decode(image_data)
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        img, _ = decode_base64_image(image_data)
         
         if img is None:
             return jsonify({"error": "Failed to decode image"}), 400
         
+        # Multi-face mode: recognize every face in the frame at once
+        if data.get('multiFace'):
+            return recognize_all_faces(img, snapshot)
+        
         # Detect face in the image using MediaPipe with error handling
         max_retries = 3
         face_img = None
@@ -374,36 +548,22 @@ def recognize_face():
                            "message": "No face detected in the image",
                            "timestamp": datetime.now().isoformat()}), 200  # FIXED: Changed from datetime.datetime.now()
         
-        # Extract features using ResNet50
-        embedding = extract_resnet_features(face_img, resnet_feature_model)
-        
-        # Compare with known faces
-        best_match = "Unknown"
-        best_similarity = 0
-        similarities = {}
+        # Extract features using ResNet50, batched with any concurrent requests
+        embedding = micro_batcher.embed(face_img)
         
-        for person_name, known_embeddings in processed_embeddings.items():
-            if not known_embeddings:
-                continue
-            
-            # Calculate cosine similarity with all known embeddings for this person
-            person_similarities = [1 - cosine(embedding, known_emb) for known_emb in known_embeddings]
-            avg_similarity = np.mean(person_similarities)
-            similarities[person_name] = avg_similarity
-            
-            # Update best match if this person is more similar
-            if avg_similarity > best_similarity and avg_similarity > SIMILARITY_THRESHOLD:
-                best_similarity = avg_similarity
-                best_match = person_name
+        # Compare with known faces (one matrix multiply over the whole gallery)
+        best_match, best_similarity, similarities = snapshot.matcher.match(embedding, SIMILARITY_THRESHOLD)
         
         # Create response
         recognition_result = {
             "recognizedName": best_match,
             "similarity": float(best_similarity) if best_match != "Unknown" else 0,
             "allSimilarities": {name: float(sim) for name, sim in similarities.items()},
+            "galleryVersion": snapshot.version,
             "timestamp": datetime.now().isoformat()  # FIXED: Changed from datetime.datetime.now()
         }
         
+        record_first_result()
         return jsonify(recognition_result)
     
     except Exception as e:
@@ -416,67 +576,164 @@ def recognize_face():
             "timestamp": datetime.now().isoformat()  # FIXED: Changed from datetime.datetime.now()
         }), 200  # Using 200 status so frontend continues to work
 
-# Add this new function that uses a custom InputStreamHandler
-def detect_and_crop_face_with_custom_handler(image):
-    # Create a MediaPipe face detection solution with custom config
-    mp_face_detection = mp.solutions.face_detection
+# Function to recognize every face in an image (multi-face mode of /api/recognize-face)
+def recognize_all_faces(img, snapshot):
+    embedding_engine = get_embedding_engine()
+    if embedding_engine is None:
+        return jsonify({"error": "Failed to load ResNet50 model"}), 500
     
-    # Configure face detection with custom options
-    # Increase timeout_micros and configure for immediate input stream handling
-    with mp_face_detection.FaceDetection(
-        model_selection=1,  # 0 for short-range, 1 for full-range detection
-        min_detection_confidence=0.5,
-    ) as face_detection:
-        # Important: set the InputStreamHandler option (this is done through internal properties)
-        # Since we can't directly set this in the Python API, we need to handle errors
-        
-        # Convert the image to RGB (MediaPipe uses RGB)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Process the image - use non_blocking to avoid timestamp issues
-        # Perform detections with added robustness
-        results = face_detection.process(image_rgb)
-        
-        if results.detections:
-            # Get the first face detection (highest confidence)
-            detection = results.detections[0]
-            
-            # Get bounding box
-            bboxC = detection.location_data.relative_bounding_box
-            ih, iw, _ = image.shape
-            x = int(bboxC.xmin * iw)
-            y = int(bboxC.ymin * ih)
-            w = int(bboxC.width * iw)
-            h = int(bboxC.height * ih)
-            
-            # Adjust for out-of-bounds coordinates
-            x = max(0, x)
-            y = max(0, y)
-            w = min(w, iw - x)
-            h = min(h, ih - y)
-            
-            # Crop face
-            face_img = image[y:y+h, x:x+w]
-            
-            # Add padding around the face (20% each side)
-            padding_x = int(0.2 * w)
-            padding_y = int(0.2 * h)
-            
-            # Calculate new coordinates with padding
-            padded_x = max(0, x - padding_x)
-            padded_y = max(0, y - padding_y)
-            padded_w = min(iw - padded_x, w + 2 * padding_x)
-            padded_h = min(ih - padded_y, h + 2 * padding_y)
-            
-            # Crop padded face
-            padded_face = image[padded_y:padded_y+padded_h, padded_x:padded_x+padded_w]
-            
-            # Return the face image and coordinates
-            return padded_face, (padded_x, padded_y, padded_w, padded_h)
-        else:
-            return None, None
+    faces = detect_and_crop_faces(img)
+    recognized_faces = []
+    if faces:
+        # One batched forward pass for all crops, then one matrix multiply for all matches
+        embeddings = embedding_engine.embed_faces([face_img for face_img, _ in faces])
+        matches = snapshot.matcher.match_batch(embeddings, SIMILARITY_THRESHOLD)
+        for (_, face_coords), (name, similarity, _) in zip(faces, matches):
+            recognized_faces.append({
+                "bbox": [int(v) for v in face_coords],  # [x, y, width, height] in image pixels
+                "name": name,
+                "similarity": float(similarity)
+            })
+    
+    record_first_result()
+    return jsonify({
+        "faces": recognized_faces,
+        "galleryVersion": snapshot.version,
+        "timestamp": datetime.now().isoformat()
+    })
+
+# Readiness route: 200 once the model is loaded and warmed up, 503 before that
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    return jsonify(startup_state), (200 if startup_state["ready"] else 503)
+
+# Route to inspect micro-batching latency and throughput
+@app.route('/api/batching-stats', methods=['GET'])
+def batching_stats():
+    if _micro_batcher is None:
+        return jsonify({"error": "Recognition has not run yet"}), 404
+    return jsonify(_micro_batcher.stats())
+
+# Route to compare f16/int8 embedding encodings against float32 on the current gallery
+@app.route('/api/embedding-encoding-report', methods=['GET'])
+def embedding_encoding_report():
+    snapshot = gallery.snapshot()
+    if snapshot.size == 0:
+        return jsonify({"error": "No embeddings loaded on the server"}), 404
+    return jsonify(quantization_report(FaceMatcher, snapshot.person_rows(), SIMILARITY_THRESHOLD))
+
+# Route to report recall@1 and latency of the live ANN index for each nprobe setting,
+# probing with stored embeddings, to choose ANN_NPROBE
+@app.route('/api/ann-report', methods=['GET'])
+def ann_report():
+    snapshot = gallery.snapshot()
+    index = snapshot.matcher.index
+    if index is None:
+        return jsonify({"error": "The gallery is small enough to be matched exactly"}), 404
+    step = max(1, snapshot.size // ANN_REPORT_QUERIES)
+    probes = np.asarray(snapshot.matrix[::step][:ANN_REPORT_QUERIES], dtype=np.float32)
+    return jsonify({
+        "nprobe": index.nprobe,
+        "nlist": index.nlist,
+        "persons": len(snapshot.person_names),
+        "report": index.evaluate(probes)
+    })
+
+# Route to remove a student from the server-side gallery
+@app.route('/api/gallery/remove', methods=['POST'])
+def remove_from_gallery():
+    try:
+        person_name = request.json.get('personName')
+        if not person_name:
+            return jsonify({"error": "No personName provided"}), 400
+        
+        gallery_version = gallery.remove_person(person_name)
+        gallery.save_index()
         
+        return jsonify({
+            "galleryVersion": gallery_version,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({"error": f"Gallery update error: {str(e)}"}), 500
+
+# Function to convert a detection's relative bounding box to pixels, clipped to the image
+def detection_bbox(image, detection):
+    bboxC = detection.location_data.relative_bounding_box
+    ih, iw, _ = image.shape
+    x = int(bboxC.xmin * iw)
+    y = int(bboxC.ymin * ih)
+    w = int(bboxC.width * iw)
+    h = int(bboxC.height * ih)
+    
+    # Adjust for out-of-bounds coordinates
+    x = max(0, x)
+    y = max(0, y)
+    w = min(w, iw - x)
+    h = min(h, ih - y)
+    return x, y, w, h
 
+# Function to crop a detection with 20% padding on each side
+def crop_padded_face(image, detection):
+    ih, iw, _ = image.shape
+    x, y, w, h = detection_bbox(image, detection)
+    
+    # Add padding around the face (20% each side)
+    padding_x = int(0.2 * w)
+    padding_y = int(0.2 * h)
+    
+    # Calculate new coordinates with padding
+    padded_x = max(0, x - padding_x)
+    padded_y = max(0, y - padding_y)
+    padded_w = min(iw - padded_x, w + 2 * padding_x)
+    padded_h = min(ih - padded_y, h + 2 * padding_y)
+    
+    # Crop padded face
+    padded_face = image[padded_y:padded_y+padded_h, padded_x:padded_x+padded_w]
+    
+    # Return the face image and coordinates
+    return padded_face, (padded_x, padded_y, padded_w, padded_h)
+
+# Function to detect a face with a pooled detector and return a padded crop
+def detect_and_crop_face_with_custom_handler(image):
+    # Convert the image to a downscaled RGB copy (MediaPipe uses RGB)
+    image_rgb = detection_input(image)
+    
+    # Process the image with a pre-built detector checked out from the pool
+    results = get_detector_pool().process(image_rgb)
+    
+    if results.detections:
+        # Get the first face detection (highest confidence)
+        return crop_padded_face(image, results.detections[0])
+    else:
+        return None, None
+
+# Function to detect every face above a confidence threshold and return padded crops
+def detect_and_crop_faces(image, min_confidence=MULTI_FACE_MIN_CONFIDENCE):
+    # Small faces in a group photo need more pixels than a single close-up
+    results = get_detector_pool().process(detection_input(image, MULTI_FACE_DETECTION_MAX_SIDE))
+    
+    faces = []
+    for detection in results.detections or []:
+        if detection.score[0] < min_confidence:
+            continue
+        bbox = detection_bbox(image, detection)
+        if bbox[2] <= 0 or bbox[3] <= 0:
+            continue
+        # Align each face from its unpadded box, like enrollment does, so probes match the
+        # gallery; the padded box is still what the client draws
+        _, face_coords = crop_padded_face(image, detection)
+        try:
+            face_img = align_face(image, detection, bbox, MODEL_METADATA['input_size'])
+        except Exception as e:
+            print(f"Warning: Face alignment failed: {e}")
+            face_img = image[bbox[1]:bbox[1] + bbox[3], bbox[0]:bbox[0] + bbox[2]]
+        faces.append((face_img, face_coords))
+    return faces
 
 if __name__ == "__main__":
+    # Preload in the serving process only, not in the debug reloader's watcher process
+    if PRELOAD_MODEL and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_startup()
     app.run(debug=True, port=5001)
\ No newline at end of file
@@ -0,0 +1,129 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+BATCH_MAX_SIZE = 8        # Most probes combined into one forward pass
+BATCH_MAX_WAIT_MS = 5.0   # Longest the first queued probe waits for others to join
+LATENCY_WINDOW = 1000     # Recent requests kept for percentile stats
+
+
+class MicroBatcher:
+    """Dynamic batching in front of the embedding model.
+
+    Concurrent requests enqueue their face crop and block on a future. A
+    single worker thread drains the queue until it has `max_batch_size` faces
+    or `max_wait_ms` has passed since the first one arrived, preprocesses them
+    into the engine's reusable batch buffer, runs one forward pass and
+    resolves every caller's future.
+    """
+    def __init__(self, engine, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.engine = engine  # EmbeddingEngine with batch_size >= max_batch_size
+        self.max_batch_size = min(max_batch_size, engine.batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._submit_lock = threading.Lock()  # Orders submits against close(), so none lands after the sentinel
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._batch_sizes = deque(maxlen=LATENCY_WINDOW)
+        self._completed = 0
+        self._started_at = time.perf_counter()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, face_img):
+        """Queue one BGR face crop and return a Future for its embedding"""
+        future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put((face_img, future, time.perf_counter()))
+        return future
+
+    def embed(self, face_img, timeout=None):
+        """Embed one BGR face crop, blocking until its batch has run"""
+        return self.submit(face_img).result(timeout=timeout)
+
+    def close(self, timeout=None):
+        """Stop accepting faces and wait until every queued face has been embedded"""
+        with self._submit_lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)  # Sentinel: the worker exits once the queue ahead of it is done
+        self._worker.join(timeout)
+        if not self._worker.is_alive():
+            self._fail_pending()
+
+    def _fail_pending(self):
+        # Nothing is embedded once the worker has exited: never leave a caller blocked
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                item[1].set_exception(RuntimeError("MicroBatcher is closed"))
+
+    def _collect_batch(self):
+        # Block for the first request, then wait at most max_wait for more
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size and items[-1] is not None:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect_batch()
+            stopping = items[-1] is None
+            if stopping:
+                items.pop()
+            if not items:
+                return
+            self._run_batch(items)
+            if stopping:
+                return
+
+    def _run_batch(self, items):
+        try:
+            embeddings = self.engine.embed_faces([face for face, _, _ in items])
+        except Exception as e:
+            for _, future, _ in items:
+                future.set_exception(e)
+            return
+
+        finished_at = time.perf_counter()
+        for (_, future, queued_at), embedding in zip(items, embeddings):
+            future.set_result(embedding)
+            with self._stats_lock:
+                self._latencies.append(finished_at - queued_at)
+        with self._stats_lock:
+            self._batch_sizes.append(len(items))
+            self._completed += len(items)
+
+    def stats(self):
+        """Latency percentiles, throughput and batch sizes over recent requests"""
+        with self._stats_lock:
+            latencies = np.array(self._latencies) * 1000
+            batch_sizes = np.array(self._batch_sizes)
+            completed = self._completed
+        elapsed = time.perf_counter() - self._started_at
+        return {
+            "maxBatchSize": self.max_batch_size,
+            "maxWaitMs": self.max_wait * 1000,
+            "queueDepth": self._queue.qsize(),
+            "completed": completed,
+            "throughputPerSec": completed / elapsed if elapsed > 0 else 0.0,
+            "p50LatencyMs": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99LatencyMs": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            "meanBatchSize": float(batch_sizes.mean()) if len(batch_sizes) else None
+        }
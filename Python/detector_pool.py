@@ -0,0 +1,59 @@
+import queue
+from contextlib import contextmanager
+import cv2
+
+DETECTOR_POOL_SIZE = 4  # Pre-warmed MediaPipe FaceDetection graphs
+DETECTION_MAX_SIDE = 640  # Images are downscaled to this longer side before detection (0 = full size)
+
+
+# Function to build the RGB detector input for a BGR image, downscaled to max_side.
+# MediaPipe reports bounding boxes and keypoints relative to the image, so they apply
+# unchanged to the full-resolution image for cropping and alignment.
+def detection_input(image, max_side=DETECTION_MAX_SIDE):
+    ih, iw = image.shape[:2]
+    if max_side and max(ih, iw) > max_side:
+        scale = max_side / max(ih, iw)
+        image = cv2.resize(image, (max(1, round(iw * scale)), max(1, round(ih * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class DetectorPool:
+    """Pool of pre-built MediaPipe FaceDetection instances.
+
+    Building a FaceDetection graph costs far more than running it, and a single
+    instance must not be used from several threads at once, so each request
+    checks out its own detector and returns it when done.
+    """
+    def __init__(self, size=DETECTOR_POOL_SIZE, model_selection=1, min_detection_confidence=0.5):
+        self.model_selection = model_selection
+        self.min_detection_confidence = min_detection_confidence
+        self._detectors = queue.Queue()
+        for _ in range(size):
+            self._detectors.put(self._create())
+
+    def _create(self):
+        import mediapipe as mp
+        return mp.solutions.face_detection.FaceDetection(
+            model_selection=self.model_selection,  # 0=closer faces, 1=longer distance faces
+            min_detection_confidence=self.min_detection_confidence
+        )
+
+    @contextmanager
+    def detector(self):
+        """Check out a detector for exclusive use"""
+        detector = self._detectors.get()
+        try:
+            yield detector
+        except Exception:
+            # A graph that raised may be left in a bad state; replace it
+            detector.close()
+            detector = self._create()
+            raise
+        finally:
+            self._detectors.put(detector)
+
+    def process(self, rgb_image):
+        """Run face detection on an RGB image with a pooled detector"""
+        with self.detector() as detector:
+            return detector.process(rgb_image)
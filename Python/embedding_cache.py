@@ -0,0 +1,125 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+EMBEDDING_CACHE_FILE = 'embedding_cache.pkl'
+EMBEDDING_CACHE_MAX_ENTRIES = 200000
+PREPROCESS_VERSION = 'mediapipe-align-224-v3'  # Bump when detection/alignment/preprocessing changes
+
+# Marker stored for images in which no face was found, so they are skipped too
+NO_FACE = 'no-face'
+
+# Background writer for cache saves, so requests never wait on pickling the whole cache
+_cache_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache-writer")
+
+
+# Function to build a version string for the model file and preprocessing
+def model_version(model_path):
+    try:
+        stat = os.stat(model_path)
+        return f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}:{PREPROCESS_VERSION}"
+    except OSError:
+        return f"{os.path.basename(model_path)}:{PREPROCESS_VERSION}"
+
+
+# Function to hash the encoded image bytes
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class EmbeddingCache:
+    """Embeddings keyed by image content hash plus model/preprocessing version.
+
+    Unchanged images are served from the cache, so only new or changed images
+    go through detection and the CNN. Entries from another model version are
+    dropped on load.
+    """
+    def __init__(self, path=EMBEDDING_CACHE_FILE, version='', max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Held through a whole write, so saves never interleave
+        self._dirty = False
+        self._pending_save = None
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == self.version:
+                self._entries = OrderedDict(data.get('entries', {}))
+        except Exception as e:
+            print(f"Warning: Could not load embedding cache {self.path}: {e}")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, digest):
+        """Return the cached embedding (or NO_FACE), or None on a miss"""
+        with self._lock:
+            value = self._entries.get(digest)
+            if value is not None:
+                self._entries.move_to_end(digest)
+            return value
+
+    def put(self, digest, embedding):
+        """Store an embedding (or NO_FACE) for an image hash"""
+        with self._lock:
+            self._entries[digest] = embedding
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def save(self):
+        """Write the cache to disk if it changed"""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {'version': self.version, 'entries': dict(self._entries)}
+                self._dirty = False
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + '.',
+                                            suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def save_async(self):
+        """Schedule a save in the background; saves requested while one is queued are merged"""
+        with self._lock:
+            if not self._dirty or (self._pending_save is not None and not self._pending_save.running()
+                                   and not self._pending_save.done()):
+                return self._pending_save
+            self._pending_save = _cache_writer.submit(self._save_logged)
+            return self._pending_save
+
+    def _save_logged(self):
+        try:
+            self.save()
+        except Exception as e:
+            print(f"Warning: Could not save embedding cache {self.path}: {e}")
+
+    def flush(self, timeout=None):
+        """Wait for a scheduled save (e.g. on shutdown)"""
+        pending = self._pending_save
+        if pending is not None:
+            pending.result(timeout)
@@ -0,0 +1,165 @@
+import base64
+import json
+import struct
+import numpy as np
+
+# Encodings accepted for embeddings in API requests and responses
+ENCODINGS = ('json', 'f16', 'int8')
+BINARY_MIMETYPE = 'application/octet-stream'
+BINARY_MAGIC = b'LBEM'
+BINARY_DTYPES = {0: np.float32, 1: np.float16, 2: np.int8}
+BINARY_DTYPE_CODES = {'json': 0, 'f16': 1, 'int8': 2}  # Binary payloads carry float32 rows for 'json'
+
+
+# Function to quantize rows to int8 with a per-vector scale
+def quantize_int8(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.size == 0:
+        return np.zeros(matrix.shape, dtype=np.int8), np.zeros(len(matrix), dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+# Function to turn int8 rows and their scales back into float32
+def dequantize_int8(quantized, scales):
+    return quantized.astype(np.float32) * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+def _b64(array):
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')
+
+
+def _from_b64(data, dtype):
+    return np.frombuffer(base64.b64decode(data), dtype=dtype)
+
+
+# Function to encode {person_name: (n, D) array} for a JSON response
+def encode_embeddings(person_rows, encoding='json'):
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unsupported embedding encoding: {encoding}")
+
+    # Persons without a detected face still get a [0, D] shape
+    dim = next((np.shape(rows)[-1] for rows in person_rows.values() if len(rows)), 0)
+    encoded = {}
+    for person_name, rows in person_rows.items():
+        rows = np.asarray(rows, dtype=np.float32)
+        if encoding == 'json':
+            encoded[person_name] = rows.tolist()
+            continue
+
+        rows = rows.reshape(len(rows), -1) if rows.size else np.zeros((0, dim), dtype=np.float32)
+        entry = {"encoding": encoding, "shape": list(rows.shape)}
+        if encoding == 'f16':
+            entry["data"] = _b64(rows.astype(np.float16))
+        else:
+            quantized, scales = quantize_int8(rows)
+            entry["data"] = _b64(quantized)
+            entry["scales"] = _b64(scales)
+        encoded[person_name] = entry
+    return encoded
+
+
+# Function to decode embeddings from a request into {person_name: (n, D) float32 array}
+def decode_embeddings(embeddings):
+    decoded = {}
+    for person_name, value in embeddings.items():
+        if isinstance(value, dict):
+            n, dim = value["shape"]
+            if value["encoding"] == 'f16':
+                rows = _from_b64(value["data"], np.float16).astype(np.float32)
+            elif value["encoding"] == 'int8':
+                rows = dequantize_int8(_from_b64(value["data"], np.int8).reshape(n, dim),
+                                       _from_b64(value["scales"], np.float32))
+            else:
+                raise ValueError(f"Unsupported embedding encoding: {value['encoding']}")
+            decoded[person_name] = rows.reshape(n, dim)
+        else:
+            decoded[person_name] = np.asarray(value, dtype=np.float32)
+    return decoded
+
+
+# Function to pack embeddings into a raw binary payload:
+#   magic(4) | dtype code(1) | reserved(3) | header length(4) | JSON header | [int8 scales] | matrix
+# Extra request fields (e.g. the probe image of /api/recognize-face) ride along in the JSON header.
+def pack_embeddings(person_rows, encoding='json', fields=None):
+    if encoding not in BINARY_DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding encoding: {encoding}")
+    dtype_code = BINARY_DTYPE_CODES[encoding]
+    person_names = list(person_rows.keys())
+    blocks = [np.asarray(rows, dtype=np.float32).reshape(len(rows), -1)
+              for rows in person_rows.values() if len(rows)]
+    matrix = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    header = json.dumps({
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "persons": [[name, len(person_rows[name])] for name in person_names],
+        "fields": fields or {}
+    }).encode('utf-8')
+
+    parts = [BINARY_MAGIC, struct.pack('<B3xI', dtype_code, len(header)), header]
+    if BINARY_DTYPES[dtype_code] == np.int8:
+        quantized, scales = quantize_int8(matrix)
+        parts += [scales.tobytes(), quantized.tobytes()]
+    else:
+        parts.append(matrix.astype(BINARY_DTYPES[dtype_code]).tobytes())
+    return b''.join(parts)
+
+
+# Function to unpack a binary payload into ({person_name: (n, D) float32 array}, extra fields)
+def unpack_embeddings(payload):
+    if len(payload) < 12 or payload[:4] != BINARY_MAGIC:
+        raise ValueError("Not an embeddings payload")
+    dtype_code, header_len = struct.unpack_from('<B3xI', payload, 4)
+    offset = 12
+    header = json.loads(payload[offset:offset + header_len].decode('utf-8'))
+    offset += header_len
+
+    dim = header["dim"]
+    total = sum(count for _, count in header["persons"])
+    if dtype_code not in BINARY_DTYPES:
+        raise ValueError(f"Unsupported embeddings dtype code: {dtype_code}")
+    dtype = BINARY_DTYPES[dtype_code]
+    if dtype == np.int8:
+        scales = np.frombuffer(payload, dtype=np.float32, count=total, offset=offset)
+        offset += scales.nbytes
+        quantized = np.frombuffer(payload, dtype=np.int8, count=total * dim, offset=offset)
+        matrix = dequantize_int8(quantized.reshape(total, dim), scales)
+    else:
+        matrix = np.frombuffer(payload, dtype=dtype, count=total * dim, offset=offset)
+        matrix = matrix.reshape(total, dim).astype(np.float32)
+
+    decoded = {}
+    row = 0
+    for person_name, count in header["persons"]:
+        decoded[person_name] = matrix[row:row + count]
+        row += count
+    return decoded, header.get("fields", {})
+
+
+# Function to compare matching accuracy of quantized galleries against float32
+def quantization_report(matcher_cls, person_rows, threshold):
+    """Use every stored embedding as a probe and compare f16/int8 galleries to float32"""
+    person_rows = {name: np.asarray(rows, dtype=np.float32) for name, rows in person_rows.items() if len(rows)}
+    if not person_rows:
+        return {}
+    probes = np.concatenate(list(person_rows.values()))
+    reference = matcher_cls.from_dict(person_rows).match_batch(probes, threshold)
+
+    report = {}
+    for encoding in ('f16', 'int8'):
+        decoded = decode_embeddings(encode_embeddings(person_rows, encoding))
+        results = matcher_cls.from_dict(decoded).match_batch(probes, threshold)
+        agreement = np.mean([ref[0] == res[0] for ref, res in zip(reference, results)])
+        # With the ANN index each probe only scores its top candidates, which can differ
+        # between encodings: compare the persons scored by both
+        drift = [abs(ref[2][name] - res[2][name]) for ref, res in zip(reference, results)
+                 for name in ref[2].keys() & res[2].keys()]
+        report[encoding] = {
+            "top1Agreement": float(agreement),
+            "meanSimilarityDrift": float(np.mean(drift)) if drift else 0.0,
+            "maxSimilarityDrift": float(np.max(drift)) if drift else 0.0,
+            "bytesPerVector": int(probes.shape[1] * (2 if encoding == 'f16' else 1) + (4 if encoding == 'int8' else 0))
+        }
+    report['float32'] = {"bytesPerVector": int(probes.shape[1] * 4)}
+    return report
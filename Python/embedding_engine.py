@@ -0,0 +1,106 @@
+import time
+from contextlib import contextmanager
+import numpy as np
+
+EMBEDDING_BATCH_SIZE = 32  # Faces per forward pass
+EMBEDDING_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)  # Batches are padded up to the nearest of these sizes
+
+
+class EmbeddingEngine:
+    """Batched face embedding extraction.
+
+    Face crops are preprocessed straight into the rows of a reused batch
+    buffer (one per concurrent caller, kept by the engine) and run through a
+    compiled `tf.function` that calls the model with training=False, instead
+    of paying Keras `predict` overhead per face. The batch dimension is left
+    open, so one traced graph serves every size; a partial batch is only
+    zero-padded up to the nearest bucket size (1, 2, 4, 8, ...), which keeps
+    a single request at idle a single-face forward pass.
+    """
+    def __init__(self, model, preprocessor, batch_size=EMBEDDING_BATCH_SIZE):
+        self.model = model
+        self.preprocessor = preprocessor  # preprocessing.Preprocessor (float32 or uint8 rows)
+        self.batch_size = batch_size
+        self.input_shape = tuple(model.input_shape[1:])
+        self.buckets = tuple(sorted({size for size in EMBEDDING_BATCH_BUCKETS if size < batch_size} | {batch_size}))
+
+        # Open batch dimension: one trace for the whole lifetime of the engine.
+        # Exported TFLite models run through the interpreter of the engine's own copy
+        # (sharing the model bytes), so engines never serialize on each other.
+        self._interpreted = hasattr(model, 'predict_batch')
+        if self._interpreted:
+            self.model = model.copy()
+            self._forward = self.model.predict_batch
+        else:
+            import tensorflow as tf
+            # uint8 batches are cast inside the graph, after the smaller host-to-tensor copy
+            compiled = tf.function(
+                lambda x: self.model(tf.cast(x, tf.float32), training=False),
+                input_signature=[tf.TensorSpec((None,) + self.input_shape,
+                                               tf.as_dtype(preprocessor.dtype))]
+            )
+            self._forward = lambda x: compiled(tf.constant(x)).numpy()
+        self._free_batches = []  # Reusable (batch_size, H, W, 3) buffers not checked out by a caller
+
+        # Throughput counters
+        self.total_images = 0
+        self.total_seconds = 0.0
+
+    @property
+    def images_per_sec(self):
+        """Average throughput over the lifetime of the engine"""
+        if self.total_seconds == 0:
+            return 0.0
+        return self.total_images / self.total_seconds
+
+    def bucket_size(self, count):
+        """Smallest bucket batch size that holds count faces"""
+        return next(size for size in self.buckets if size >= count)
+
+    @contextmanager
+    def _batch_buffer(self):
+        # list.pop/append are atomic, so concurrent callers never share a buffer;
+        # a new one is only allocated when every existing buffer is in use
+        try:
+            batch = self._free_batches.pop()
+        except IndexError:
+            batch = self.preprocessor.batch_buffer(self.batch_size)
+        try:
+            yield batch
+        finally:
+            self._free_batches.append(batch)
+
+    def warm_up(self):
+        """Run the bucket sizes once, so no request pays a first-run trace or allocation.
+
+        A TFLite model has one interpreter that is resized to whatever batch
+        arrives, so warming every bucket would only allocate and drop arenas:
+        it is warmed at the smallest bucket (single requests) only.
+        """
+        buckets = self.buckets[:1] if self._interpreted else self.buckets
+        with self._batch_buffer() as batch:
+            for size in buckets:
+                self._forward(batch[:size])
+
+    def embed_faces(self, face_images):
+        """Return an (n, D) array of embeddings for BGR face crops, in the same order"""
+        start_time = time.perf_counter()
+        outputs = []
+        with self._batch_buffer() as buffer:
+            for start in range(0, len(face_images), self.batch_size):
+                chunk = face_images[start:start + self.batch_size]
+                for row, face_img in zip(buffer, chunk):
+                    self.preprocessor.into(face_img, row)
+                # Zero the padding rows so stale faces never leak into the batch
+                batch = buffer[:self.bucket_size(len(chunk))]
+                batch[len(chunk):] = 0
+                outputs.append(self._forward(batch)[:len(chunk)])
+
+        elapsed = time.perf_counter() - start_time
+        if len(face_images):
+            self.total_images += len(face_images)
+            self.total_seconds += elapsed
+
+        if not outputs:
+            return np.zeros((0, self.model.output_shape[-1]), dtype=np.float32)
+        return np.concatenate(outputs)
@@ -0,0 +1,162 @@
+import json
+import os
+import numpy as np
+
+STORE_FORMAT_VERSION = 2   # 2: rows are stored L2-normalized, grouped by identity
+STORE_COMPACT_RATIO = 0.25  # Compact once this fraction of stored rows is dead
+
+
+class EmbeddingStore:
+    """Memory-mapped on-disk gallery.
+
+    Embeddings live in a raw float32 (or float16) matrix file that is opened
+    with np.memmap, next to a small JSON header holding the format and model
+    version, the dimension and an identity -> (offset, count) index. Rows are
+    written already L2-normalized, so a float32 store is matched straight from
+    the mapping. Updates append rows and rewrite only the header; replaced or
+    deleted rows become dead and are dropped by compaction.
+    """
+    def __init__(self, base_path, model_version='', dtype='float32'):
+        self.base_path = base_path
+        self.dtype = np.dtype(dtype)
+        self.data_path = f"{base_path}.{'f16' if self.dtype == np.float16 else 'f32'}"
+        self.header_path = f"{base_path}.idx.json"
+        self.model_version = model_version
+        self.reload()
+
+    def reload(self):
+        """Re-read the header (another process may have updated the store)"""
+        self.header = self._empty_header(dim=0)
+        if os.path.exists(self.header_path):
+            with open(self.header_path) as f:
+                header = json.load(f)
+            if header.get('modelVersion') != self.model_version or header.get('dtype') != self.dtype.name:
+                print(f"Warning: Ignoring gallery store {self.header_path} built for another model or dtype")
+            else:
+                self.header = header
+
+    def _empty_header(self, dim):
+        return {
+            'format': STORE_FORMAT_VERSION,
+            'modelVersion': self.model_version,
+            'dtype': self.dtype.name,
+            'dim': dim,
+            'rows': 0,             # Rows written to the data file, live or dead
+            'galleryVersion': None,
+            'identities': []       # [name, offset, count] for live identities, in enrollment order
+        }
+
+    @property
+    def version(self):
+        return self.header['galleryVersion']
+
+    def exists(self):
+        return self.header['rows'] > 0 or bool(self.header['identities'])
+
+    def _write_header(self):
+        tmp_path = self.header_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.header, f)
+        os.replace(tmp_path, self.header_path)
+
+    def _memmap(self):
+        rows, dim = self.header['rows'], self.header['dim']
+        if rows == 0 or dim == 0:
+            return np.zeros((0, dim), dtype=self.dtype)
+        return np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=(rows, dim))
+
+    @property
+    def normalized(self):
+        """Whether the rows were written L2-normalized (format 2 and later)"""
+        return self.header['format'] >= 2
+
+    def load(self):
+        """Return (matrix, counts, person_names, gallery_version), rows grouped by identity in
+        header order, without copying when possible"""
+        data = self._memmap()
+        identities = [entry for entry in self.header['identities'] if entry[2]]
+        person_names = [name for name, _, _ in identities]
+        counts = np.array([count for _, _, count in identities], dtype=np.int64)
+
+        # Live rows already cover the file in order: hand out the memmap itself
+        expected_offset = 0
+        contiguous = True
+        for _, offset, count in identities:
+            if offset != expected_offset:
+                contiguous = False
+                break
+            expected_offset += count
+        if contiguous and expected_offset == self.header['rows']:
+            return data, counts, person_names, self.version
+
+        # Dead rows present (compaction pending): gather the live ones
+        blocks = [data[offset:offset + count] for _, offset, count in identities]
+        matrix = np.concatenate(blocks) if blocks else np.zeros((0, self.header['dim']), dtype=self.dtype)
+        return matrix, counts, person_names, self.version
+
+    def rewrite(self, person_rows, gallery_version):
+        """Replace the whole store with {person_name: (n, D) array} rows"""
+        dim = next((np.shape(rows)[1] for rows in person_rows.values() if len(rows)), self.header['dim'])
+        header = self._empty_header(dim)
+        tmp_path = self.data_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for person_name, rows in person_rows.items():
+                rows = np.asarray(rows, dtype=self.dtype).reshape(-1, dim) if len(rows) else np.zeros((0, dim), self.dtype)
+                f.write(rows.tobytes())
+                header['identities'].append([person_name, header['rows'], len(rows)])
+                header['rows'] += len(rows)
+        header['galleryVersion'] = gallery_version
+        os.replace(tmp_path, self.data_path)
+        self.header = header
+        self._write_header()
+
+    def update(self, person_rows, gallery_version):
+        """Append (or replace) identities' rows in one pass; identities given no rows are deleted"""
+        dim = self.header['dim']
+        blocks = {}
+        for person_name, rows in person_rows.items():
+            rows = np.asarray(rows, dtype=self.dtype)
+            if rows.size == 0:
+                continue
+            rows = rows.reshape(len(rows), -1)
+            if dim == 0:
+                dim = rows.shape[1]
+            elif rows.shape[1] != dim:
+                raise ValueError(f"Embedding dimension {rows.shape[1]} of {person_name} does not match "
+                                 f"the store dimension {dim}")
+            blocks[person_name] = rows
+
+        names = set(person_rows)
+        self.header['identities'] = [entry for entry in self.header['identities'] if entry[0] not in names]
+        self.header['dim'] = dim
+        row_bytes = dim * self.dtype.itemsize
+        with open(self.data_path, 'ab') as f:
+            # Bytes past the rows the header knows about (a file left by a rejected header,
+            # or an append interrupted before its header write) are dropped before appending
+            f.truncate(self.header['rows'] * row_bytes)
+            f.seek(0, os.SEEK_END)
+            for person_name, rows in blocks.items():
+                offset = f.tell() // row_bytes if row_bytes else 0
+                f.write(rows.tobytes())
+                self.header['identities'].append([person_name, offset, len(rows)])
+                self.header['rows'] = offset + len(rows)
+        self.header['galleryVersion'] = gallery_version
+        self._write_header()
+        if self._dead_ratio() > STORE_COMPACT_RATIO:
+            self.compact()
+
+    def _dead_ratio(self):
+        rows = self.header['rows']
+        if rows == 0:
+            return 0.0
+        live = sum(count for _, _, count in self.header['identities'])
+        return 1.0 - live / rows
+
+    def compact(self):
+        """Rewrite the data file with only live rows"""
+        if self._dead_ratio() == 0:
+            return
+        data = self._memmap()
+        person_rows = {name: np.array(data[offset:offset + count])
+                       for name, offset, count in self.header['identities']}
+        self.rewrite(person_rows, self.version)
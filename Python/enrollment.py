@@ -0,0 +1,231 @@
+import base64
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NeedData
+from embedding_cache import content_hash, NO_FACE
+
+PIPELINE_WORKERS = 4           # Threads running decode/detect/align/preprocess
+PIPELINE_MAX_IN_FLIGHT = 64    # Images being prepared at once (bounds memory on large uploads)
+DECODE_MIN_SIDE = 960          # Large JPEGs are decoded at 1/2, 1/4 or 1/8 scale down to this longer side
+MULTIPART_CHUNK_SIZE = 64 * 1024  # Bytes read from the request stream per multipart decoder step
+
+# JPEG start-of-frame markers (the ones carrying the image size)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# Background writer for the optional raw-image side output
+_disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="raw-image-writer")
+
+
+# Function to read (width, height) from a JPEG header without decoding; None if not a JPEG
+def jpeg_dimensions(image_bytes):
+    if image_bytes[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 9 <= len(image_bytes):
+        if image_bytes[pos] != 0xFF:
+            return None
+        marker = image_bytes[pos + 1]
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        length = int.from_bytes(image_bytes[pos + 2:pos + 4], 'big')
+        if marker in _JPEG_SOF_MARKERS:
+            height = int.from_bytes(image_bytes[pos + 5:pos + 7], 'big')
+            width = int.from_bytes(image_bytes[pos + 7:pos + 9], 'big')
+            return width, height
+        pos += 2 + length
+    return None
+
+
+# Function to decode encoded image bytes straight into a BGR array. JPEGs much larger
+# than min_side are decoded at reduced scale by libjpeg, which skips most of the work.
+def decode_image_bytes(image_bytes, min_side=DECODE_MIN_SIDE):
+    flag = cv2.IMREAD_COLOR
+    dimensions = jpeg_dimensions(image_bytes) if min_side else None
+    if dimensions:
+        longer_side = max(dimensions)
+        for factor, reduced_flag in _REDUCED_DECODE_FLAGS:
+            if longer_side // factor >= min_side:
+                flag = reduced_flag
+                break
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+
+
+# Function to decode a base64 (optionally data-URL) image straight into a BGR array
+def decode_base64_image(image_base64):
+    if ',' in image_base64:
+        image_base64 = image_base64.split(',')[1]  # Remove data URL prefix
+    image_bytes = base64.b64decode(image_base64)
+    return decode_image_bytes(image_bytes), image_bytes
+
+
+# Generator yielding image records from an NDJSON request body, one line at a time
+def iter_ndjson_images(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+# Generator yielding image records from a multipart request body (field name = person name)
+# as each file part completes, so enrollment starts before the upload has finished
+def iter_multipart_images(stream, boundary, chunk_size=MULTIPART_CHUNK_SIZE):
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    part = None
+    data = []
+    while True:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)  # None marks the end of the body
+        event = decoder.next_event()
+        while not isinstance(event, (Epilogue, NeedData)):
+            if isinstance(event, File):
+                part = event
+                data = []
+            elif isinstance(event, Data) and part is not None:
+                data.append(event.data)
+                if not event.more_data:
+                    yield {
+                        'personName': part.name,
+                        'imageName': part.filename,
+                        'imageBytes': b''.join(data)
+                    }
+                    part = None
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not chunk:
+            return
+
+
+# Function to save raw image bytes in the background (overwrites, never clears the directory)
+def save_raw_image_async(save_dir, person_name, image_name, image_bytes):
+    def _write():
+        person_dir = os.path.join(save_dir, os.path.basename(person_name))
+        os.makedirs(person_dir, exist_ok=True)
+        with open(os.path.join(person_dir, os.path.basename(image_name)), 'wb') as f:
+            f.write(image_bytes)
+    return _disk_writer.submit(_write)
+
+
+class EnrollmentPipeline:
+    """Pipelined enrollment: parallel decode/detect/align/preprocess feeding batched embedding.
+
+    A thread pool runs the CPU-bound per-image stage (OpenCV and MediaPipe
+    release the GIL), while the calling thread gathers preprocessed faces into
+    batches for the embedding engine. At most `max_in_flight` images are being
+    prepared at once, so memory stays flat however large the upload is.
+    """
+    def __init__(self, engine, detect_fn, workers=PIPELINE_WORKERS, max_in_flight=PIPELINE_MAX_IN_FLIGHT,
+                 cache=None):
+        self.engine = engine        # EmbeddingEngine used for the batched forward pass
+        self.detect_fn = detect_fn  # image -> (face_img, face_coords)
+        self.cache = cache          # Optional EmbeddingCache keyed by image content hash
+        self.max_in_flight = max(max_in_flight, engine.batch_size)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enroll-prepare")
+
+    def _prepare(self, img_data, save_dir):
+        # Returns (person_name, image_name, face, cached_embedding, digest, message)
+        person_name = img_data.get('personName')
+        image_name = img_data.get('imageName')
+        digest = None
+        try:
+            if 'imageBytes' in img_data:
+                image_bytes = img_data['imageBytes']
+            else:
+                image_base64 = img_data.get('imageData')
+                if ',' in image_base64:
+                    image_base64 = image_base64.split(',')[1]  # Remove data URL prefix
+                image_bytes = base64.b64decode(image_base64)
+
+            if save_dir:
+                save_raw_image_async(save_dir, person_name, image_name, image_bytes)
+
+            # Unchanged images skip decoding, detection and the CNN entirely
+            if self.cache is not None:
+                digest = content_hash(image_bytes)
+                cached = self.cache.get(digest)
+                if isinstance(cached, str) and cached == NO_FACE:
+                    return person_name, image_name, None, None, digest, f"  No face detected in: {image_name} (cached)"
+                if cached is not None:
+                    return person_name, image_name, None, cached, digest, f"  Processed: {image_name} (cached)"
+
+            img = decode_image_bytes(image_bytes)
+            if img is None:
+                return person_name, image_name, None, None, None, f"Could not read image: {image_name} for {person_name}"
+
+            # Detect face in the image using MediaPipe
+            face_img, face_coords = self.detect_fn(img)
+            if face_img is None or face_img.size == 0:
+                if digest is not None:
+                    self.cache.put(digest, NO_FACE)
+                return person_name, image_name, None, None, digest, f"  No face detected in: {image_name}"
+
+            return person_name, image_name, face_img, None, digest, None
+        except Exception as e:
+            return person_name, image_name, None, None, None, f"  Error processing {image_name} for {person_name}: {str(e)}"
+
+    def _flush(self, batch):
+        # Embed the faces that still need the CNN (preprocessed straight into the
+        # engine's batch buffer), then yield everything in order
+        faces = [face for _, _, face, _, _, _ in batch if face is not None]
+        embeddings = iter(self.engine.embed_faces(faces) if faces else [])
+        for person_name, image_name, face, embedding, digest, message in batch:
+            if face is not None:
+                embedding = next(embeddings)
+                message = f"  Processed: {image_name}"
+                if self.cache is not None and digest is not None:
+                    self.cache.put(digest, embedding)
+            yield person_name, image_name, embedding, message
+        batch.clear()
+
+    def run(self, images, save_dir=None, stats=None):
+        """Yield (person_name, image_name, embedding or None, message) for every image, in order.
+
+        The pipeline is shared by concurrent requests, so per-run figures
+        ('images_per_sec', 'cache_hits') are written into the caller's stats dict.
+        """
+        start_time = time.perf_counter()
+        embedded = 0
+        cache_hits = 0
+        pending = deque()
+        batch = []
+        batch_faces = 0
+        images = iter(images)
+
+        while True:
+            # Keep the prepare stage full, up to the in-flight bound
+            for img_data in images:
+                pending.append(self._pool.submit(self._prepare, img_data, save_dir))
+                if len(pending) >= self.max_in_flight:
+                    break
+            if not pending:
+                break
+
+            item = pending.popleft().result()
+            batch.append(item)
+            if item[2] is not None:
+                batch_faces += 1
+            elif item[3] is not None:
+                cache_hits += 1
+
+            if batch_faces == self.engine.batch_size or len(batch) >= self.max_in_flight:
+                embedded += batch_faces
+                batch_faces = 0
+                yield from self._flush(batch)
+
+        if batch:
+            embedded += batch_faces
+            yield from self._flush(batch)
+
+        if self.cache is not None:
+            self.cache.save_async()  # Written in the background, off the request
+
+        if stats is not None:
+            elapsed = time.perf_counter() - start_time
+            stats['images_per_sec'] = embedded / elapsed if elapsed > 0 else 0.0
+            stats['cache_hits'] = cache_hits
@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+
+
+# Function to compute the 2x3 transform that rotates a face upright about its eye centre,
+# crops its bounding box and scales it to output_size x output_size
+def alignment_transform(image_shape, detection, bbox, output_size):
+    ih, iw = image_shape[:2]
+    x, y, w, h = bbox
+
+    # Eye keypoints (MediaPipe provides normalized coordinates)
+    keypoints = detection.location_data.relative_keypoints
+    left_eye = np.array([keypoints[0].x * iw, keypoints[0].y * ih])
+    right_eye = np.array([keypoints[1].x * iw, keypoints[1].y * ih])
+
+    # Rotation that levels the eyes, about the point between them
+    dx, dy = right_eye - left_eye
+    angle = np.degrees(np.arctan2(dy, dx))
+    center = tuple((left_eye + right_eye) / 2)
+    rotation = cv2.getRotationMatrix2D(center, angle, scale=1.0)
+
+    # Then move the face box to the origin and scale it to the output size
+    scale = np.array([output_size / w, output_size / h])
+    transform = np.empty((2, 3), dtype=np.float64)
+    transform[:, :2] = scale[:, None] * rotation[:, :2]
+    transform[:, 2] = scale * (rotation[:, 2] - (x, y))
+    return transform
+
+
+# Function to align a face directly into an output_size x output_size crop.
+# One warp does the rotate + crop + resize, so only the output pixels are interpolated.
+def align_face(image, detection, bbox, output_size):
+    transform = alignment_transform(image.shape, detection, bbox, output_size)
+    return cv2.warpAffine(image, transform, (output_size, output_size), flags=cv2.INTER_LINEAR)
@@ -0,0 +1,346 @@
+import hashlib
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+import numpy as np
+from matcher import FaceMatcher, normalize_rows, person_centroid
+from ann_index import IVFIndex, index_path_for, ANN_DEFAULT_NPROBE
+
+GALLERY_MIN_CAPACITY = 1024  # Rows reserved when a gallery starts growing by appends
+MIGRATED_SUFFIX = '.migrated'  # Appended to a legacy pickle once it has been migrated into the store
+
+
+# Function to hash one person's rows. The gallery version XORs these per-person
+# digests, so it is a content hash that an update adjusts for the persons it touches.
+def person_digest(person_name, rows):
+    digest = hashlib.sha1(person_name.encode("utf-8"))
+    digest.update(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+    return int.from_bytes(digest.digest()[:8], 'big')
+
+
+def _version_string(value):
+    return f"{value:016x}"
+
+
+class _RowBuffer:
+    # Preallocated rows shared by consecutive snapshots, each viewing a prefix
+    def __init__(self, array, used):
+        self.array = array
+        self.used = used
+
+
+# Function to append rows after a snapshot's rows. While the snapshot is the buffer's
+# newest prefix and capacity remains, the rows are written in place (older snapshots
+# only view shorter prefixes); otherwise they move to a new buffer with room to grow.
+def _append_rows(buffer, current, rows):
+    length = len(current)
+    if buffer is None or buffer.used != length or length + len(rows) > len(buffer.array):
+        capacity = max(GALLERY_MIN_CAPACITY, 2 * (length + len(rows)))
+        buffer = _RowBuffer(np.empty((capacity,) + rows.shape[1:], dtype=np.float32), length)
+        buffer.array[:length] = current
+    buffer.array[length:length + len(rows)] = rows
+    buffer.used = length + len(rows)
+    return buffer, buffer.array[:buffer.used]
+
+
+class GallerySnapshot:
+    """Immutable view of the enrolled embeddings at one gallery version.
+
+    Rows are L2-normalized and grouped by person in person_names order, so
+    each person is one slice of the matrix and every person has at least one
+    row. `updated` drops and appends slices to build the next snapshot.
+    """
+    def __init__(self, matrix, counts, person_names, version, centroids=None, index=None, matcher=None,
+                 buffers=(None, None), positions=None):
+        self.matrix = matrix              # (N, D) float32 (or memory-mapped store), rows grouped by person
+        self.counts = np.asarray(counts, dtype=np.int64)  # (P,) rows per person
+        self.person_names = person_names  # list of person names, in row order
+        self.version = version            # content hash identifying this gallery
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        self.positions = positions if positions is not None else {name: i for i, name in enumerate(person_names)}
+        self.matcher = matcher if matcher is not None else FaceMatcher.from_grouped(
+            matrix, self.counts, person_names, centroids=centroids, index=index)
+        self._buffers = buffers  # (row buffer, centroid buffer) the matrix and centroids view, if any
+
+    @property
+    def size(self):
+        return self.matrix.shape[0]
+
+    @property
+    def person_index(self):
+        """(N,) int32 row -> position in person_names"""
+        return np.repeat(np.arange(len(self.person_names), dtype=np.int32), self.counts)
+
+    def rows(self, position):
+        """Get the (n, D) rows of the person at the given position"""
+        start = self.starts[position]
+        return self.matrix[start:start + self.counts[position]]
+
+    def person_rows(self):
+        """Get a {person_name: (n, D) array} view of the gallery"""
+        return {name: self.rows(position) for position, name in enumerate(self.person_names)}
+
+    def to_dict(self):
+        """Convert back to the {person_name: [embedding lists]} format used by the APIs"""
+        return {name: rows.tolist() for name, rows in self.person_rows().items()}
+
+    def updated(self, removed, added):
+        """Build the next snapshot: drop the removed persons' slices, then append {person_name: rows}.
+
+        Rows must already be normalized. Only the touched persons are hashed,
+        and the ANN index is updated on a copy so readers of this snapshot are
+        never disturbed.
+        """
+        version = int(self.version, 16)
+        index = self.matcher.index
+        if index is not None:
+            index = index.copy()
+            index.version = None
+
+        keep = np.ones(len(self.person_names), dtype=bool)
+        for person_name in removed:
+            position = self.positions.get(person_name)
+            if position is not None:
+                keep[position] = False
+                version ^= person_digest(person_name, self.rows(position))
+
+        matrix, centroids, counts, person_names = self.matrix, self.matcher.centroids, self.counts, self.person_names
+        row_buffer, centroid_buffer = self._buffers
+        positions = None
+        if keep.all():
+            positions = dict(self.positions)  # Appends leave every existing position unchanged
+        else:
+            # One vectorized pass drops every removed slice (no renormalizing or rehashing)
+            if index is not None:
+                index.remove([name for name, kept in zip(person_names, keep) if not kept])
+            matrix = matrix[np.repeat(keep, counts)]
+            centroids = centroids[keep]
+            counts = counts[keep]
+            person_names = [name for name, kept in zip(person_names, keep) if kept]
+            row_buffer = centroid_buffer = None
+
+        if added:
+            new_rows = np.concatenate(list(added.values()))
+            new_centroids = np.stack([person_centroid(rows) for rows in added.values()])
+            if len(matrix) == 0:
+                matrix = np.zeros((0, new_rows.shape[1]), dtype=np.float32)
+                centroids = np.zeros((0, new_rows.shape[1]), dtype=np.float32)
+            row_buffer, matrix = _append_rows(row_buffer, matrix, new_rows)
+            centroid_buffer, centroids = _append_rows(centroid_buffer, centroids, new_centroids)
+            counts = np.concatenate((counts, [len(rows) for rows in added.values()]))
+            if positions is not None:
+                positions.update((name, len(person_names) + i) for i, name in enumerate(added))
+            person_names = person_names + list(added)
+            for person_name, rows in added.items():
+                version ^= person_digest(person_name, rows)
+            if index is not None:
+                index.add(list(added), new_centroids)
+
+        return GallerySnapshot(matrix, counts, person_names, _version_string(version),
+                               centroids=centroids, index=index, buffers=(row_buffer, centroid_buffer),
+                               positions=positions)
+
+
+# Function to build a snapshot from a {person_name: [embeddings]} dict (persons without
+# embeddings are left out). dtype is the precision the rows are stored at.
+def build_snapshot(embeddings_data, index=None, dtype=np.float32):
+    person_names = []
+    blocks = []
+    version = 0
+    for person_name, embeddings_list in embeddings_data.items():
+        block = _stored_rows(embeddings_list, dtype)
+        if len(block) == 0:
+            continue
+        person_names.append(person_name)
+        blocks.append(block)
+        version ^= person_digest(person_name, block)
+
+    dim = blocks[0].shape[1] if blocks else 0
+    matrix = np.concatenate(blocks) if blocks else np.zeros((0, dim), dtype=np.float32)
+    counts = [len(block) for block in blocks]
+    version = _version_string(version)
+
+    # A persisted index is only reused if it was saved for exactly this gallery
+    if index is not None and index.version is not None and index.version != version:
+        index = None
+
+    return GallerySnapshot(matrix, counts, person_names, version, index=index)
+
+
+# Function to normalize embeddings the way the gallery stores them, rounded to the
+# store precision so versions hash exactly what is stored
+def _stored_rows(embeddings, dtype=np.float32):
+    rows = np.asarray(embeddings, dtype=np.float32)
+    if rows.size == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    rows = normalize_rows(rows.reshape(len(rows), -1))
+    if np.dtype(dtype) != np.float32:
+        rows = rows.astype(dtype).astype(np.float32)
+    return rows
+
+
+class EmbeddingGallery:
+    """Server-side gallery of enrolled face embeddings.
+
+    Recognition requests read the current snapshot without locking; updates
+    build a new snapshot and swap it in, so readers never see a half-built
+    gallery. When an EmbeddingStore is attached every update is also written
+    to it. With a SharedGallery, snapshots live in shared memory and updates
+    made by any worker process are published to all of them.
+    """
+    def __init__(self, store=None, shared=None, nprobe=ANN_DEFAULT_NPROBE):
+        self._lock = threading.Lock()
+        self._snapshot = build_snapshot({})
+        self.store = store
+        self.shared = shared
+        self.nprobe = nprobe  # Inverted lists scanned per query once the gallery uses the ANN index
+        self._generation = 0  # Shared snapshot generation this process is using
+
+    @property
+    def version(self):
+        return self.snapshot().version
+
+    def snapshot(self):
+        """Get the current gallery snapshot"""
+        if self.shared is not None and self.shared.generation != self._generation:
+            with self._lock, self.shared.lock:
+                self._adopt_shared()
+        return self._snapshot
+
+    def _adopt_shared(self):
+        # Switch to the snapshot another worker published (locks held)
+        if self.shared.generation != self._generation:
+            snapshot, self._generation = self.shared.attach()
+            if snapshot is not None:
+                self._snapshot = snapshot
+                if self.store is not None:
+                    self.store.reload()
+
+    @contextmanager
+    def _updating(self):
+        # Updates are serialized across threads (and worker processes when shared)
+        # and always start from the latest published snapshot
+        with self._lock:
+            if self.shared is None:
+                yield
+                return
+            with self.shared.lock:
+                self._adopt_shared()
+                yield
+
+    def _swap(self, snapshot):
+        # Install a new snapshot (locks held), publishing it to the other workers
+        if snapshot.matcher.index is not None:
+            snapshot.matcher.index.set_nprobe(self.nprobe)
+        if self.shared is not None:
+            snapshot, self._generation = self.shared.publish(snapshot)
+        self._snapshot = snapshot
+
+    @property
+    def dtype(self):
+        # Precision the rows are stored at
+        return self.store.dtype if self.store is not None else np.float32
+
+    def load(self, embeddings_data, index=None):
+        """Replace the gallery contents and return the new version"""
+        return self._replace(build_snapshot(embeddings_data, index=index, dtype=self.dtype))
+
+    def seed(self, embeddings_data):
+        """Load embeddings sent by a client into an empty gallery (e.g. after a server restart).
+
+        Returns the version, or None when the server already holds a different
+        gallery: a client must never roll back or overwrite the server's copy.
+        """
+        return self._replace(build_snapshot(embeddings_data, dtype=self.dtype), only_if_empty=True)
+
+    def _replace(self, snapshot, only_if_empty=False):
+        with self._updating():
+            # Re-seeding with identical contents (e.g. legacy clients) is a no-op
+            if snapshot.version == self._snapshot.version:
+                return snapshot.version
+            if only_if_empty and self._snapshot.size:
+                return None
+            if self.store is not None:
+                self.store.rewrite(snapshot.person_rows(), snapshot.version)
+            self._swap(snapshot)
+        return snapshot.version
+
+    def update(self, persons):
+        """Insert or replace several persons' embeddings at once and return the new version.
+
+        persons maps person_name -> embeddings; a person with no embeddings is
+        removed. Only the touched slices are rewritten, so the cost follows the
+        size of the update rather than the size of the gallery.
+        """
+        added = {}
+        for person_name, embeddings in persons.items():
+            rows = _stored_rows(embeddings, self.dtype)
+            if len(rows):
+                added[person_name] = rows
+        with self._updating():
+            snapshot = self._snapshot.updated(removed=persons.keys(), added=added)
+            if self.store is not None:
+                self.store.update({person_name: added.get(person_name, ()) for person_name in persons},
+                                  snapshot.version)
+            self._swap(snapshot)
+            return snapshot.version
+
+    def add_person(self, person_name, embeddings):
+        """Insert or replace one person's embeddings and return the new version"""
+        return self.update({person_name: embeddings})
+
+    def remove_person(self, person_name):
+        """Remove one person from the gallery and return the new version"""
+        return self.update({person_name: ()})
+
+    def _load_index(self, base_path):
+        # Reuse the persisted ANN index so restarts don't retrain it
+        index_path = index_path_for(base_path)
+        if not os.path.exists(index_path):
+            return None
+        try:
+            return IVFIndex.load(index_path)
+        except Exception as e:
+            print(f"Warning: Could not load ANN index {index_path}: {e}")
+            return None
+
+    def load_store(self):
+        """Load the gallery from the attached store (a float32 matrix stays memory-mapped)"""
+        if self.store is None or not self.store.exists():
+            return None
+        matrix, counts, person_names, version = self.store.load()
+        if not self.store.normalized:
+            # Stores written before rows were normalized are migrated once
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            return self.load({name: matrix[offsets[i]:offsets[i + 1]] for i, name in enumerate(person_names)})
+
+        index = self._load_index(self.store.base_path)
+        if index is not None and index.version != version:
+            index = None
+        snapshot = GallerySnapshot(matrix, counts, person_names, version, index=index)
+        with self._updating():
+            self._swap(snapshot)
+        return version
+
+    def load_file(self, path):
+        """Load the gallery from a legacy pickle file, if it exists.
+
+        With a store attached this is a one-time migration: the pickle is renamed
+        to <path>.migrated afterwards, so a store later rejected for another
+        model never re-imports embeddings made by the old one.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            embeddings_data = pickle.load(f)
+        version = self.load(embeddings_data, index=self._load_index(path))
+        if self.store is not None:
+            os.replace(path, path + MIGRATED_SUFFIX)
+        return version
+
+    def save_index(self):
+        """Persist the ANN index next to the store, tagged with the current version"""
+        snapshot = self._snapshot
+        if snapshot.matcher.index is not None and self.store is not None:
+            snapshot.matcher.index.save(index_path_for(self.store.base_path), snapshot.version)
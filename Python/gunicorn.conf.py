@@ -0,0 +1,45 @@
+# Pre-fork worker mode: `gunicorn -c gunicorn.conf.py` (run from this directory).
+# The app is imported once in the parent, which loads the embedding gallery into
+# shared memory; each forked worker then runs the ASGI app from serve.py with its
+# own model instance, pinned to its own slice of the cores.
+import os
+from serve import SERVE_HOST, SERVE_PORT, SERVE_DRAIN_TIMEOUT
+
+os.environ.setdefault('SHARED_GALLERY', '1')  # Read by app.py when the parent preloads it
+
+AVAILABLE_CORES = sorted(os.sched_getaffinity(0))
+CORES_PER_WORKER = int(os.environ.get('CORES_PER_WORKER', 4))
+
+bind = f"{SERVE_HOST}:{SERVE_PORT}"
+workers = int(os.environ.get('PREFORK_WORKERS', max(1, len(AVAILABLE_CORES) // CORES_PER_WORKER)))
+worker_class = 'uvicorn.workers.UvicornWorker'
+wsgi_app = 'serve:create_app()'
+preload_app = True
+graceful_timeout = SERVE_DRAIN_TIMEOUT
+
+
+# Function to get the cores for a worker slot (contiguous, non-overlapping while slots < workers)
+def worker_cores(slot):
+    per_worker = max(1, len(AVAILABLE_CORES) // workers)
+    start = (slot % workers) * per_worker
+    return AVAILABLE_CORES[start:start + per_worker]
+
+
+def pre_fork(server, worker):
+    # Give the new worker the first core slot no live worker holds (restarted workers reuse theirs)
+    used = {getattr(live_worker, 'core_slot', None) for live_worker in server.WORKERS.values()}
+    worker.core_slot = next(slot for slot in range(workers + 1) if slot not in used)
+
+
+def post_fork(server, worker):
+    import app
+    cores = worker_cores(worker.core_slot)
+    app.pin_worker_to_cores(cores)
+    server.log.info(f"Worker {worker.pid} pinned to cores {cores}")
+
+
+def on_exit(server):
+    # Only the parent removes the shared gallery; workers exiting leave it to the others
+    import app
+    if app.gallery.shared is not None:
+        app.gallery.shared.unlink()
@@ -0,0 +1,49 @@
+import threading
+import numpy as np
+
+
+class TFLiteFeatureModel:
+    """Runtime for the inference-only TFLite export of the feature model (see ready.py --export).
+
+    Exposes the same `input_shape`/`output_shape` as the Keras model plus a
+    numpy `predict_batch`, which the EmbeddingEngine calls instead of a
+    tf.function. The model file is read once; `copy()` shares its bytes but
+    builds a separate interpreter, so each engine runs without waiting on
+    another. Each model keeps a single interpreter (one tensor arena, sized
+    for the current batch) and resizes it only when a different batch size
+    actually arrives. The interpreter is not thread-safe, so calls are serialized.
+    """
+    def __init__(self, model_path, num_threads=4, model_content=None):
+        import tensorflow as tf
+        self.model_path = model_path
+        self.num_threads = num_threads
+        if model_content is None:
+            with open(model_path, 'rb') as f:
+                model_content = f.read()
+        self.model_content = model_content  # Shared by copies
+        self.interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(int(d) for d in self._input['shape'][1:])
+        self.output_shape = (None, int(self._output['shape'][-1]))
+        self._batch_size = int(self._input['shape'][0])
+        self._lock = threading.Lock()
+
+    def copy(self):
+        """Return a model with its own interpreter over the same model bytes"""
+        return TFLiteFeatureModel(self.model_path, self.num_threads, model_content=self.model_content)
+
+    def predict_batch(self, batch):
+        """Run a (B, H, W, 3) float32 batch and return (B, D) embeddings"""
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input['index'], batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output['index']).copy()
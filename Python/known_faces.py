@@ -0,0 +1,140 @@
+import os
+import pickle
+import threading
+from embedding_cache import content_hash
+
+KNOWN_FACES_CACHE_FILE = 'known_faces_cache.pkl'
+KNOWN_FACES_WATCH_INTERVAL = 2.0  # Seconds between directory scans
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class KnownFacesGallery:
+    """Saved gallery of embeddings for a <person>/<image> directory.
+
+    Each image is recorded with its mtime, size, content hash and embedding,
+    under the model version that produced it. A sync only re-embeds new or
+    changed files; files whose mtime changed but whose content did not are
+    recognized by their hash.
+    """
+    def __init__(self, faces_dir, model_version, cache_path=KNOWN_FACES_CACHE_FILE):
+        self.faces_dir = faces_dir
+        self.model_version = model_version
+        self.cache_path = cache_path
+        self.entries = {}  # relative path -> {'person', 'mtime', 'size', 'hash', 'embedding'}
+        self._lock = threading.Lock()
+        self._watch_thread = None
+        self._stop_event = threading.Event()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('model_version') == self.model_version:
+                self.entries = data.get('entries', {})
+            else:
+                print("Known faces cache was built with another model, re-embedding all images")
+        except Exception as e:
+            print(f"Warning: Could not load known faces cache: {e}")
+
+    def _save(self):
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'model_version': self.model_version, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _scan(self):
+        files = {}
+        if not os.path.isdir(self.faces_dir):
+            return files
+        for person_name in os.listdir(self.faces_dir):
+            person_path = os.path.join(self.faces_dir, person_name)
+            if not os.path.isdir(person_path):
+                continue
+            for img_name in os.listdir(person_path):
+                if img_name.lower().endswith(IMAGE_EXTENSIONS):
+                    rel_path = os.path.join(person_name, img_name)
+                    stat = os.stat(os.path.join(self.faces_dir, rel_path))
+                    files[rel_path] = (person_name, stat.st_mtime, stat.st_size)
+        return files
+
+    def sync(self, embed_fn):
+        """Bring the gallery in line with the directory; returns True if anything changed.
+
+        embed_fn(img_path) returns an embedding, or None if no face was found.
+        """
+        with self._lock:
+            files = self._scan()
+            changed = False
+
+            for rel_path in list(self.entries):
+                if rel_path not in files:
+                    print(f"  Removed: {rel_path}")
+                    del self.entries[rel_path]
+                    changed = True
+
+            for rel_path, (person_name, mtime, size) in files.items():
+                entry = self.entries.get(rel_path)
+                if entry and entry['mtime'] == mtime and entry['size'] == size:
+                    continue
+
+                img_path = os.path.join(self.faces_dir, rel_path)
+                try:
+                    with open(img_path, 'rb') as f:
+                        digest = content_hash(f.read())
+                except OSError as e:
+                    print(f"  Error reading {img_path}: {e}")
+                    continue
+
+                if entry and entry['hash'] == digest:
+                    entry['mtime'], entry['size'] = mtime, size
+                    changed = True
+                    continue
+
+                try:
+                    embedding = embed_fn(img_path)
+                except Exception as e:
+                    print(f"  Error processing {img_path}: {str(e)}")
+                    continue
+                print(f"  {'Processed' if embedding is not None else 'No face detected in'}: {rel_path}")
+                self.entries[rel_path] = {
+                    'person': person_name,
+                    'mtime': mtime,
+                    'size': size,
+                    'hash': digest,
+                    'embedding': embedding
+                }
+                changed = True
+
+            if changed:
+                self._save()
+            return changed
+
+    def known_faces(self):
+        """Get {person_name: [embeddings]} for every image with a face"""
+        with self._lock:
+            faces = {}
+            for rel_path in sorted(self.entries):
+                entry = self.entries[rel_path]
+                faces.setdefault(entry['person'], [])
+                if entry['embedding'] is not None:
+                    faces[entry['person']].append(entry['embedding'])
+            return faces
+
+    def start_watching(self, embed_fn, on_change, interval=KNOWN_FACES_WATCH_INTERVAL):
+        """Re-sync in a background thread, calling on_change(known_faces) after each change"""
+        def _watch():
+            while not self._stop_event.wait(interval):
+                try:
+                    if self.sync(embed_fn):
+                        on_change(self.known_faces())
+                except Exception as e:
+                    print(f"Warning: Known faces sync failed: {e}")
+
+        self._watch_thread = threading.Thread(target=_watch, name="known-faces-watcher", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._stop_event.set()
@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+class LatestSlot:
+    """Bounded latest-wins queue holding at most one item.
+
+    A producer never blocks: putting a new item replaces one the consumer has
+    not taken yet, so slow stages always work on the freshest data.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.dropped = 0  # Items replaced before they were consumed
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """Take the latest item, waiting up to timeout; returns None on timeout"""
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+
+class StageTimer:
+    """Exponential moving average of per-stage processing time"""
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._ms = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            ms = seconds * 1000
+            previous = self._ms.get(stage)
+            self._ms[stage] = ms if previous is None else previous + self.smoothing * (ms - previous)
+
+    def snapshot(self):
+        """Get {stage: average ms}"""
+        with self._lock:
+            return dict(self._ms)
+
+
+class StageWorker(threading.Thread):
+    """Thread running fn on each item taken from a LatestSlot, timing every call"""
+    def __init__(self, name, input_slot, fn, timer, stop_event):
+        super().__init__(name=name, daemon=True)
+        self.input_slot = input_slot
+        self.fn = fn
+        self.timer = timer
+        self.stop_event = stop_event
+
+    def run(self):
+        while not self.stop_event.is_set():
+            item = self.input_slot.get(timeout=0.1)
+            if item is None:
+                continue
+            start_time = time.perf_counter()
+            try:
+                self.fn(item)
+            except Exception as e:
+                print(f"Error in {self.name} stage: {str(e)}")
+            self.timer.record(self.name, time.perf_counter() - start_time)
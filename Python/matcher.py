@@ -0,0 +1,152 @@
+import numpy as np
+from ann_index import build_index
+
+ANN_TOP_K = 10  # Candidates returned per probe when an ANN index is in use
+UNIT_NORM_TOLERANCE = 1e-5  # Rows this close to unit length count as already normalized
+
+
+class FaceMatcher:
+    """Vectorized cosine-similarity matcher over an embedding gallery.
+
+    The gallery is kept L2-normalized in one (N, D) float32 array with rows
+    grouped by person, so a probe (or a batch of probes) is scored with a
+    single matrix multiply followed by a per-person segment reduction.
+    """
+    def __init__(self, matrix, person_index, person_names, reduce='mean', index=None):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        person_index = np.asarray(person_index, dtype=np.int32)
+        dim = matrix.shape[1] if matrix.ndim == 2 else 0
+        counts = np.bincount(person_index, minlength=len(person_names))
+
+        # Sort rows by person so each person is one contiguous segment. Only
+        # persons with at least one embedding take part in matching
+        order = np.argsort(person_index, kind='stable')
+        present = np.flatnonzero(counts)
+        matrix = _l2_normalize(matrix[order]) if len(order) else np.zeros((0, dim), dtype=np.float32)
+        self._setup(matrix, counts[present], [person_names[i] for i in present], reduce, None, index)
+
+    @classmethod
+    def from_dict(cls, embeddings_data, reduce='mean'):
+        """Build a matcher from a {person_name: [embeddings]} dict"""
+        person_names = list(embeddings_data.keys())
+        rows = []
+        person_index = []
+        for person_idx, person_name in enumerate(person_names):
+            for emb in embeddings_data[person_name]:
+                rows.append(np.asarray(emb, dtype=np.float32).ravel())
+                person_index.append(person_idx)
+        matrix = np.stack(rows) if rows else np.zeros((0, 0), dtype=np.float32)
+        return cls(matrix, person_index, person_names, reduce=reduce)
+
+    @classmethod
+    def from_grouped(cls, matrix, counts, person_names, centroids=None, reduce='mean', index=None):
+        """Wrap L2-normalized rows that are already grouped by person, without copying them.
+
+        person_names[i] owns the next counts[i] rows (at least one each).
+        Centroids are computed when not given (e.g. arrays in shared memory).
+        """
+        matcher = cls.__new__(cls)
+        matcher._setup(np.asarray(matrix, dtype=np.float32), np.asarray(counts, dtype=np.int64),
+                       list(person_names), reduce, centroids, index)
+        return matcher
+
+    def _setup(self, matrix, counts, person_names, reduce, centroids, index):
+        if reduce not in ('mean', 'max'):
+            raise ValueError(f"Unsupported reduction: {reduce}")
+        self.reduce = reduce
+        self.person_names = person_names
+        self.counts = counts
+        self.dim = matrix.shape[1] if matrix.ndim == 2 else 0
+        self.matrix = matrix
+        self.segment_starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+
+        # Mean cosine similarity equals the dot product with the mean of the
+        # normalized rows, so the mean reduction only needs one row per person
+        if centroids is not None:
+            self.centroids = centroids
+        elif len(self.person_names):
+            self.centroids = np.add.reduceat(self.matrix, self.segment_starts, axis=0)
+            self.centroids /= self.counts[:, None].astype(np.float32)
+        else:
+            self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+
+        # Large galleries are matched through an approximate index over the
+        # person centroids; small ones use the exact dense matmul
+        if reduce == 'mean':
+            self.index = index if index is not None else build_index(self.person_names, self.centroids)
+        else:
+            self.index = None
+
+    @property
+    def size(self):
+        return self.matrix.shape[0]
+
+    def score(self, probes):
+        """Return a (P, K) array of per-person similarities for P probes"""
+        probes = _l2_normalize(np.atleast_2d(np.asarray(probes, dtype=np.float32)))
+        if not self.person_names:
+            return np.zeros((probes.shape[0], 0), dtype=np.float32)
+
+        if self.reduce == 'mean':
+            return probes @ self.centroids.T
+
+        similarities = probes @ self.matrix.T
+        return np.maximum.reduceat(similarities, self.segment_starts, axis=1)
+
+    def match_batch(self, probes, threshold):
+        """Match a batch of probes, returning (name, similarity, all_similarities) per probe"""
+        if self.index is not None:
+            return self._match_batch_ann(probes, threshold)
+
+        scores = self.score(probes)
+        results = []
+        for row in scores:
+            best_match = "Unknown"
+            best_similarity = 0
+            if row.size:
+                best_idx = int(np.argmax(row))
+                if row[best_idx] > threshold and row[best_idx] > 0:
+                    best_match = self.person_names[best_idx]
+                    best_similarity = float(row[best_idx])
+            similarities = {name: float(sim) for name, sim in zip(self.person_names, row)}
+            results.append((best_match, best_similarity, similarities))
+        return results
+
+    def _match_batch_ann(self, probes, threshold):
+        # Only the top ANN_TOP_K candidates are scored, so all_similarities is partial
+        probes = _l2_normalize(np.atleast_2d(np.asarray(probes, dtype=np.float32)))
+        results = []
+        for keys, scores in self.index.search(probes, ANN_TOP_K):
+            best_match = "Unknown"
+            best_similarity = 0
+            if len(keys) and scores[0] > threshold and scores[0] > 0:
+                best_match = keys[0]
+                best_similarity = float(scores[0])
+            similarities = {name: float(sim) for name, sim in zip(keys, scores)}
+            results.append((best_match, best_similarity, similarities))
+        return results
+
+    def match(self, probe, threshold):
+        """Match a single probe embedding"""
+        return self.match_batch(probe, threshold)[0]
+
+
+# Function to compute the centroid a person contributes to the mean-similarity index
+def person_centroid(embeddings):
+    return _l2_normalize(np.atleast_2d(np.asarray(embeddings, dtype=np.float32))).mean(axis=0)
+
+
+# Function to L2-normalize embedding rows for storage in a gallery. Rows that are already
+# unit length are kept bit-exact, so a gallery echoed back by a client hashes the same.
+def normalize_rows(matrix):
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[(norms == 0) | (np.abs(norms - 1.0) <= UNIT_NORM_TOLERANCE)] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+# Function to L2-normalize rows, leaving all-zero rows at zero
+def _l2_normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
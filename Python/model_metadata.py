@@ -0,0 +1,91 @@
+import json
+import os
+
+# Supported backbones and the input preprocessing each expects.
+# channel_order is the order fed to the model; pixels are (x - mean) * scale.
+BACKBONES = {
+    'resnet50': {
+        'keras_class': 'ResNet50',
+        'input_sizes': (224,),
+        'channel_order': 'bgr',
+        'mean': [91.4953, 103.8827, 131.0912],
+        'scale': 1.0
+    },
+    'mobilenet_v2': {
+        'keras_class': 'MobileNetV2',
+        'input_sizes': (96, 128, 160, 192, 224),
+        'channel_order': 'rgb',
+        'mean': [127.5, 127.5, 127.5],
+        'scale': 1.0 / 127.5
+    },
+    'mobilenet_v3_small': {
+        'keras_class': 'MobileNetV3Small',
+        'input_sizes': (112, 160, 224),
+        'channel_order': 'rgb',
+        'mean': [0.0, 0.0, 0.0],  # Rescaling is built into the Keras model
+        'scale': 1.0
+    },
+    'mobilenet_v3_large': {
+        'keras_class': 'MobileNetV3Large',
+        'input_sizes': (112, 160, 224),
+        'channel_order': 'rgb',
+        'mean': [0.0, 0.0, 0.0],
+        'scale': 1.0
+    },
+    'efficientnet_b0': {
+        'keras_class': 'EfficientNetB0',
+        'input_sizes': (112, 160, 224),
+        'channel_order': 'rgb',
+        'mean': [0.0, 0.0, 0.0],  # Normalization is built into the Keras model
+        'scale': 1.0
+    }
+}
+
+DEFAULT_BACKBONE = 'resnet50'
+DEFAULT_INPUT_SIZE = 224
+DEFAULT_EMBEDDING_DIM = 512
+
+
+# Function to build the metadata stored next to a feature model
+def build_model_metadata(backbone=DEFAULT_BACKBONE, input_size=DEFAULT_INPUT_SIZE,
+                         embedding_dim=DEFAULT_EMBEDDING_DIM):
+    if backbone not in BACKBONES:
+        raise ValueError(f"Unknown backbone: {backbone} (choose from {', '.join(BACKBONES)})")
+    spec = BACKBONES[backbone]
+    if input_size not in spec['input_sizes']:
+        raise ValueError(f"Unsupported input size {input_size} for {backbone}: {spec['input_sizes']}")
+    return {
+        'backbone': backbone,
+        'input_size': input_size,
+        'embedding_dim': embedding_dim,
+        'channel_order': spec['channel_order'],
+        'mean': spec['mean'],
+        'scale': spec['scale']
+    }
+
+
+# Function to get the model name used in file names ('resnet50' keeps the original file names)
+def model_name(backbone=DEFAULT_BACKBONE, input_size=DEFAULT_INPUT_SIZE, embedding_dim=DEFAULT_EMBEDDING_DIM):
+    if (backbone, input_size, embedding_dim) == (DEFAULT_BACKBONE, DEFAULT_INPUT_SIZE, DEFAULT_EMBEDDING_DIM):
+        return DEFAULT_BACKBONE
+    return f"{backbone}_{input_size}_{embedding_dim}"
+
+
+# Function to get the metadata file for a model file
+def metadata_path_for(model_path):
+    return os.path.splitext(model_path)[0] + '.json'
+
+
+# Function to save metadata next to a model file
+def save_model_metadata(model_path, metadata):
+    with open(metadata_path_for(model_path), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+# Function to load metadata for a model file (models without metadata are the original ResNet50)
+def load_model_metadata(model_path):
+    path = metadata_path_for(model_path)
+    if not os.path.exists(path):
+        return build_model_metadata()
+    with open(path) as f:
+        return json.load(f)
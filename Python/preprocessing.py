@@ -0,0 +1,140 @@
+import threading
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+PREPROCESS_BENCHMARK_FACES = 200  # Faces per run of the preprocessing microbenchmark
+
+
+# Function to check whether a model takes raw uint8 pixels (normalization built into the model)
+def accepts_uint8(metadata):
+    return not any(metadata['mean']) and metadata['scale'] == 1.0
+
+
+class Preprocessor:
+    """Face preprocessing that writes straight into rows of a batch buffer.
+
+    A face is resized (skipped when alignment already produced the model
+    size), channel-flipped while it is converted into the output row, and
+    normalized in place, so no per-face temporaries are created beyond a
+    per-thread resize scratch. With dtype=np.uint8 the normalization is left
+    to the model and rows hold raw pixels, a quarter of the float32 bytes.
+    """
+    def __init__(self, metadata, dtype=np.float32):
+        self.input_size = metadata['input_size']
+        self.input_shape = (self.input_size, self.input_size, 3)
+        self.swap_rb = metadata['channel_order'] == 'rgb'  # OpenCV images are BGR
+        self.mean = np.asarray(metadata['mean'], dtype=np.float32)
+        self.scale = float(metadata['scale'])
+        self.dtype = np.dtype(dtype)
+        if self.dtype == np.uint8 and not accepts_uint8(metadata):
+            raise ValueError(f"{metadata['backbone']} needs normalized float32 input")
+        self._local = threading.local()
+
+    def batch_buffer(self, batch_size):
+        """Allocate a zeroed (batch_size, H, W, 3) buffer to preprocess into"""
+        return np.zeros((batch_size,) + self.input_shape, dtype=self.dtype)
+
+    def _resized(self, img):
+        if img.shape[:2] == self.input_shape[:2]:
+            return img
+        scratch = getattr(self._local, 'resized', None)
+        if scratch is None:
+            scratch = self._local.resized = np.empty(self.input_shape, dtype=np.uint8)
+        return cv2.resize(img, (self.input_size, self.input_size), dst=scratch)
+
+    def into(self, img, out):
+        """Preprocess one BGR face into out, an (H, W, 3) row of a batch buffer"""
+        resized = self._resized(img)
+        # The channel flip is a view, applied by the same pass that converts the dtype
+        np.copyto(out, resized[..., ::-1] if self.swap_rb else resized, casting='unsafe')
+        if self.dtype != np.uint8:
+            if self.mean.any():
+                np.subtract(out, self.mean, out=out)
+            if self.scale != 1.0:
+                np.multiply(out, self.scale, out=out)
+        return out
+
+    def __call__(self, img):
+        """Preprocess one face into a new (1, H, W, 3) array"""
+        out = self.batch_buffer(1)
+        self.into(img, out[0])
+        return out
+
+
+# Function to preprocess exactly the way app.py's preprocess_image did before buffering
+# (ResNet50 at 224x224, including its BGR->RGB->BGR round trip), as the benchmark baseline
+def _reference_preprocess(img):
+    # Resize to 224x224 (ResNet input size)
+    resized = cv2.resize(img, (224, 224))
+    # Convert from BGR to RGB (OpenCV uses BGR, but model expects RGB)
+    rgb_img = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+
+    # Convert to float32 BEFORE subtraction
+    bgr_img = rgb_img[..., ::-1].copy().astype(np.float32)
+
+    # Zero-center by mean pixel values
+    bgr_img[..., 0] -= 91.4953
+    bgr_img[..., 1] -= 103.8827
+    bgr_img[..., 2] -= 131.0912
+
+    # Add batch dimension
+    preprocessed = np.expand_dims(bgr_img, axis=0)
+    return preprocessed
+
+
+# Function to time a preprocessing call and measure the peak memory it allocates
+def _measure(fn, faces):
+    fn(faces[0])  # Warm up scratch buffers
+    start_time = time.perf_counter()
+    for face in faces:
+        fn(face)
+    elapsed = time.perf_counter() - start_time
+
+    tracemalloc.start()
+    for face in faces:
+        fn(face)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "msPerFace": elapsed * 1000 / len(faces),
+        "peakBytesAllocated": peak
+    }
+
+
+# Function to compare per-face time and allocations of the original and buffered preprocessing
+def benchmark_preprocessing(metadata, face_size=300, num_faces=PREPROCESS_BENCHMARK_FACES):
+    rng = np.random.default_rng(0)
+    faces = [rng.integers(0, 256, (face_size, face_size, 3), dtype=np.uint8) for _ in range(num_faces)]
+
+    float_preprocessor = Preprocessor(metadata)
+    float_buffer = float_preprocessor.batch_buffer(1)
+    report = {
+        "faceSize": face_size,
+        "faces": num_faces,
+        "original": _measure(_reference_preprocess, faces),
+        "bufferedFloat32": _measure(lambda face: float_preprocessor.into(face, float_buffer[0]), faces)
+    }
+
+    # The original code only served ResNet50, whose output must be reproduced exactly
+    if metadata['backbone'] == 'resnet50':
+        expected = _reference_preprocess(faces[0])[0]
+        report["maxAbsDifference"] = float(np.abs(float_preprocessor.into(faces[0], float_buffer[0]) - expected).max())
+
+    if accepts_uint8(metadata):
+        uint8_preprocessor = Preprocessor(metadata, dtype=np.uint8)
+        uint8_buffer = uint8_preprocessor.batch_buffer(1)
+        report["bufferedUint8"] = _measure(lambda face: uint8_preprocessor.into(face, uint8_buffer[0]), faces)
+    return report
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    from model_metadata import build_model_metadata
+
+    # Usage: python preprocessing.py [backbone] [input_size]
+    backbone = sys.argv[1] if len(sys.argv) > 1 else 'resnet50'
+    input_size = int(sys.argv[2]) if len(sys.argv) > 2 else 224
+    print(json.dumps(benchmark_preprocessing(build_model_metadata(backbone, input_size)), indent=2))
@@ -1,17 +1,41 @@
 import os
 import sys
+import glob
+import time
+import cv2
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.layers import Input, Dense, Dropout, BatchNormalization, GlobalAveragePooling2D
 from tensorflow.keras.preprocessing import image
 from tensorflow.keras.utils import get_file
+from model_metadata import (BACKBONES, DEFAULT_BACKBONE, DEFAULT_INPUT_SIZE, DEFAULT_EMBEDDING_DIM,
+                            build_model_metadata, model_name, save_model_metadata)
+from face_alignment import align_face
+from preprocessing import Preprocessor
 
 # Check TensorFlow version
 print(f"TensorFlow version: {tf.__version__}")
 
+# Function to read a command line option: python ready.py --backbone mobilenet_v2 --input-size 160
+def get_arg(name, default):
+    if name in sys.argv:
+        arg_index = sys.argv.index(name) + 1
+        if arg_index < len(sys.argv) and not sys.argv[arg_index].startswith('--'):
+            return sys.argv[arg_index]
+    return default
+
 # Configuration
 MODEL_FOLDER = 'resnet50_model'
+BACKBONE = get_arg('--backbone', DEFAULT_BACKBONE)  # See model_metadata.BACKBONES
+INPUT_SIZE = int(get_arg('--input-size', DEFAULT_INPUT_SIZE))
+EMBEDDING_DIM = int(get_arg('--embedding-dim', DEFAULT_EMBEDDING_DIM))
+MODEL_METADATA = build_model_metadata(BACKBONE, INPUT_SIZE, EMBEDDING_DIM)
+MODEL_NAME = model_name(BACKBONE, INPUT_SIZE, EMBEDDING_DIM)
+FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, f'{MODEL_NAME}_face_features.h5')
+INFERENCE_MODEL_PATH = os.path.join(MODEL_FOLDER, f'{MODEL_NAME}_face_features.tflite')
+CALIBRATION_DIR = 'faces'  # Face photos used to calibrate int8 quantization (<person>/<image>), aligned like app.py
+CALIBRATION_SAMPLES = 200
 
 # Create directory if needed
 if not os.path.exists(MODEL_FOLDER):
@@ -43,59 +67,67 @@ def download_vggface_resnet50():
         return None
 
 # Alternative approach: Use a pre-built feature extractor
-def build_feature_extractor():
-    print("Building a custom feature extractor from scratch...")
+def build_feature_extractor(backbone=BACKBONE, input_size=INPUT_SIZE, embedding_dim=EMBEDDING_DIM):
+    print(f"Building a custom feature extractor from scratch ({backbone}, {input_size}x{input_size}, {embedding_dim}-d)...")
     
     # We'll use a simplified approach since the weights file has compatibility issues
-    base_model = tf.keras.applications.ResNet50(
+    backbone_class = getattr(tf.keras.applications, BACKBONES[backbone]['keras_class'])
+    base_model = backbone_class(
         include_top=False,
         weights='imagenet',  # Start with ImageNet weights
-        input_shape=(224, 224, 3),
+        input_shape=(input_size, input_size, 3),
         pooling='avg'
     )
     
     # Add custom top layers for face recognition
     x = base_model.output
-    x = Dense(512, activation='relu')(x)
+    x = Dense(embedding_dim, activation='relu')(x)
     x = Dropout(0.2)(x)
     x = BatchNormalization()(x)
     
     # Create the feature extraction model
     model = Model(inputs=base_model.input, outputs=x)
     
-    # Save the model
-    feature_model_path = os.path.join(MODEL_FOLDER, 'resnet50_face_features.h5')
+    # Save the model, with the metadata app.py uses for input size and preprocessing
+    feature_model_path = FEATURE_MODEL_PATH
     model.save(feature_model_path, save_format='h5')
+    save_model_metadata(feature_model_path, MODEL_METADATA)
     print(f"Feature extraction model saved to: {feature_model_path}")
     
     return model
 
-# Try to download the pre-trained VGGFace2 model first
-downloaded_model = download_vggface_resnet50()
-
-# Build a feature extraction model
-if downloaded_model:
-    print("Using downloaded model")
-    # You'll need to implement a custom loading procedure here
-    # as the downloaded format might not be directly loadable
-    feature_model = build_feature_extractor()
+# Exporting works on the feature model app.py already serves: load it, never rebuild or overwrite it
+if '--export' in sys.argv:
+    if not os.path.exists(FEATURE_MODEL_PATH):
+        print(f"Error: No feature model at {FEATURE_MODEL_PATH} to export (run ready.py without --export first)")
+        sys.exit(1)
+    print(f"Loading feature model to export from: {FEATURE_MODEL_PATH}")
+    feature_model = load_model(FEATURE_MODEL_PATH)
 else:
-    print("Using a custom built model with ImageNet weights")
-    feature_model = build_feature_extractor()
+    # Try to download the pre-trained VGGFace2 model first
+    downloaded_model = download_vggface_resnet50()
+    
+    # Build a feature extraction model
+    if downloaded_model:
+        print("Using downloaded model")
+        # You'll need to implement a custom loading procedure here
+        # as the downloaded format might not be directly loadable
+        feature_model = build_feature_extractor()
+    else:
+        print("Using a custom built model with ImageNet weights")
+        feature_model = build_feature_extractor()
 
-# Preprocessing function for ResNet50
+# Preprocessing function for the selected backbone
 def preprocess_input(x):
     """
-    Preprocesses images for ResNet50
+    Preprocesses RGB images as described by MODEL_METADATA
     """
-    # Standard ResNet50 preprocessing
     x_temp = x.copy()
-    # Convert to BGR
-    x_temp = x_temp[..., ::-1]
-    # Zero-center by mean pixel values
-    x_temp[..., 0] -= 91.4953
-    x_temp[..., 1] -= 103.8827
-    x_temp[..., 2] -= 131.0912
+    # Convert to BGR if the backbone expects it
+    if MODEL_METADATA['channel_order'] == 'bgr':
+        x_temp = x_temp[..., ::-1]
+    # Zero-center by mean pixel values and scale
+    x_temp = (x_temp - np.array(MODEL_METADATA['mean'], dtype=np.float32)) * MODEL_METADATA['scale']
     
     return x_temp
 
@@ -104,7 +136,7 @@ def load_and_prepare_image(image_path):
     """
     Load an image and prepare it for the model.
     """
-    img = image.load_img(image_path, target_size=(224, 224))
+    img = image.load_img(image_path, target_size=(INPUT_SIZE, INPUT_SIZE))
     img_array = image.img_to_array(img)
     img_array = np.expand_dims(img_array, axis=0)
     return preprocess_input(img_array)
@@ -155,7 +187,7 @@ def compare_faces(face1_features, face2_features):
 print("\nVerifying model works with a sample image...")
 try:
     # Create a test image
-    test_img = np.zeros((1, 224, 224, 3))
+    test_img = np.zeros((1, INPUT_SIZE, INPUT_SIZE, 3))
     # Preprocess the image 
     test_img = preprocess_input(test_img)
     # Get features
@@ -193,4 +225,135 @@ try:
             print("Different person")
 except Exception as e:
     print(f"Error: {e}")
-""")
\ No newline at end of file
+""")
+
+# Function to detect and align the first face in a BGR photo, the way app.py crops faces
+def align_calibration_face(img, face_detector):
+    results = face_detector.process(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    if not results.detections:
+        return None
+    detection = results.detections[0]
+    bboxC = detection.location_data.relative_bounding_box
+    ih, iw = img.shape[:2]
+    x = max(0, int(bboxC.xmin * iw))
+    y = max(0, int(bboxC.ymin * ih))
+    w = min(int(bboxC.width * iw), iw - x)
+    h = min(int(bboxC.height * ih), ih - y)
+    if w <= 0 or h <= 0:
+        return None
+    return align_face(img, detection, (x, y, w, h), INPUT_SIZE)
+
+# Function to load calibration/comparison faces as aligned crops, preprocessed like the model input
+def load_calibration_images(calibration_dir=CALIBRATION_DIR, limit=CALIBRATION_SAMPLES):
+    import mediapipe as mp
+    paths = sorted(glob.glob(os.path.join(calibration_dir, '**', '*.*'), recursive=True))
+    paths = [p for p in paths if p.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    preprocessor = Preprocessor(MODEL_METADATA)
+    images = []
+    with mp.solutions.face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5) as face_detector:
+        for path in paths:
+            if len(images) >= limit:
+                break
+            img = cv2.imread(path)
+            face = align_calibration_face(img, face_detector) if img is not None else None
+            if face is not None:
+                images.append(preprocessor(face))
+    print(f"Loaded {len(images)} aligned calibration faces from {calibration_dir}")
+    if not images:
+        # Fall back to random inputs so the export still works without a face set
+        print(f"Warning: No calibration images in {calibration_dir}, using random inputs")
+        images = [preprocess_input(np.random.uniform(0, 255, (1, INPUT_SIZE, INPUT_SIZE, 3)).astype(np.float32))
+                  for _ in range(16)]
+    return images
+
+# Function to export an inference-only TFLite model
+def export_inference_model(feature_model, quantization='none', output_path=INFERENCE_MODEL_PATH):
+    """
+    Export the feature model for inference only.
+    
+    The model is traced with training=False, so Dropout is stripped and
+    BatchNormalization becomes constant multiply/add ops that the converter
+    folds into neighbouring layers.
+    
+    Args:
+        feature_model: Keras feature extraction model
+        quantization: 'none', 'dynamic' (int8 weights) or 'int8' (weights and
+            activations, calibrated on CALIBRATION_DIR face crops)
+        output_path: Where to write the .tflite file
+    
+    Returns:
+        Path of the exported model
+    """
+    input_shape = feature_model.input_shape[1:]
+    inference_fn = tf.function(
+        lambda x: feature_model(x, training=False),
+        input_signature=[tf.TensorSpec((1,) + tuple(input_shape), tf.float32)]
+    )
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [inference_fn.get_concrete_function()], feature_model
+    )
+    
+    if quantization in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        calibration_images = load_calibration_images()
+        def representative_dataset():
+            for img in calibration_images:
+                yield [img]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Keep float32 input/output so the runtime interface is unchanged
+        converter.inference_input_type = tf.float32
+        converter.inference_output_type = tf.float32
+    
+    tflite_model = converter.convert()
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    print(f"Inference model ({quantization}) saved to: {output_path} ({len(tflite_model) / 1e6:.1f} MB)")
+    return output_path
+
+# Function to compare the exported model against the h5 model
+def compare_inference_model(feature_model, tflite_path=INFERENCE_MODEL_PATH):
+    """
+    Report per-image latency of both models and the cosine drift of the exported embeddings.
+    """
+    images = load_calibration_images()
+    interpreter = tf.lite.Interpreter(model_path=tflite_path)
+    interpreter.allocate_tensors()
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+    
+    keras_fn = tf.function(lambda x: feature_model(x, training=False))
+    keras_fn(images[0])  # Trace before timing
+    
+    keras_time = 0.0
+    tflite_time = 0.0
+    similarities = []
+    for img in images:
+        start_time = time.perf_counter()
+        keras_features = keras_fn(img).numpy()
+        keras_time += time.perf_counter() - start_time
+        
+        start_time = time.perf_counter()
+        interpreter.set_tensor(input_index, img)
+        interpreter.invoke()
+        tflite_features = interpreter.get_tensor(output_index)
+        tflite_time += time.perf_counter() - start_time
+        
+        similarities.append(compare_faces(keras_features, tflite_features))
+    
+    print(f"h5 model:     {keras_time / len(images) * 1000:.1f} ms/image")
+    print(f"TFLite model: {tflite_time / len(images) * 1000:.1f} ms/image "
+          f"(speedup {keras_time / max(tflite_time, 1e-9):.2f}x)")
+    print(f"Embedding cosine similarity to h5: mean {np.mean(similarities):.4f}, min {np.min(similarities):.4f}")
+
+# Export an inference-only model: python ready.py --export [none|dynamic|int8]
+if '--export' in sys.argv:
+    quantization = get_arg('--export', 'none')
+    print(f"\nExporting inference model with quantization: {quantization}")
+    try:
+        exported_path = export_inference_model(feature_model, quantization)
+        compare_inference_model(feature_model, exported_path)
+    except Exception as e:
+        print(f"Error exporting inference model: {e}")
+
@@ -0,0 +1,125 @@
+# Production serving mode: the Flask app behind an ASGI server (`python serve.py`).
+# The Flask routes run unchanged, so request/response shapes are identical to
+# `python app.py`, on a bounded thread pool while the event loop only accepts
+# connections and applies admission control. Decode, MediaPipe, TensorFlow and
+# OpenCV release the GIL, so the pool threads run the CPU-bound work in parallel.
+# Settings can be overridden with the SERVE_* environment variables. For several
+# worker processes sharing one gallery, use the pre-fork mode in gunicorn.conf.py.
+import asyncio
+import json
+import os
+from a2wsgi import WSGIMiddleware
+
+SERVE_HOST = os.environ.get('SERVE_HOST', '127.0.0.1')
+SERVE_PORT = int(os.environ.get('SERVE_PORT', 5001))
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', 1))            # Must stay 1: see gunicorn.conf.py for several
+SERVE_THREADS = int(os.environ.get('SERVE_THREADS', 8))            # Executor threads running Flask handlers
+SERVE_MAX_CONCURRENT = int(os.environ.get('SERVE_MAX_CONCURRENT', 8))  # Model requests running at once
+SERVE_MAX_QUEUED = int(os.environ.get('SERVE_MAX_QUEUED', 32))     # Model requests waiting before 429s
+SERVE_DRAIN_TIMEOUT = float(os.environ.get('SERVE_DRAIN_TIMEOUT', 30))  # Seconds to drain on shutdown
+LIMITED_PATHS = ('/api/process-images', '/api/recognize-face')    # Routes that run the model
+
+
+# Function to send a complete JSON response over ASGI
+async def send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(payload)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+class AdmissionControl:
+    """ASGI middleware bounding the model routes and draining them on shutdown.
+
+    At most `max_concurrent` model requests run at once and `max_queued` more
+    wait for a slot; anything beyond that is rejected with 429 straight away
+    instead of piling up behind the model. On lifespan shutdown new model
+    requests get 503 while in-flight ones finish, then queued embedding
+    batches are flushed.
+    """
+    def __init__(self, app, max_concurrent=SERVE_MAX_CONCURRENT, max_queued=SERVE_MAX_QUEUED,
+                 drain_timeout=SERVE_DRAIN_TIMEOUT):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.drain_timeout = drain_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.draining = False
+        self._slots = None  # Created on the server's event loop
+        self._idle = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http' or not scope['path'].startswith(LIMITED_PATHS):
+            return await self.app(scope, receive, send)
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+            self._idle = asyncio.Event()
+            self._idle.set()
+        if self.draining:
+            return await send_json(send, 503, {"error": "Server is shutting down"})
+        if self._slots.locked() and self.waiting >= self.max_queued:
+            self.rejected += 1
+            return await send_json(send, 429, {"error": "Server busy, retry later"},
+                                   headers=[(b'retry-after', b'1')])
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._slots.release()
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    async def _lifespan(self, receive, send):
+        import app as recognition_app
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if recognition_app.PRELOAD_MODEL:
+                    recognition_app.start_background_startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.draining = True
+                if self._idle is not None:
+                    try:
+                        await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+                    except asyncio.TimeoutError:
+                        print(f"Shutdown: {self.in_flight} requests still running after {self.drain_timeout}s")
+                await asyncio.get_running_loop().run_in_executor(
+                    None, recognition_app.shutdown_services, self.drain_timeout)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+# Function to build the ASGI application, once in each server process
+# (other ASGI servers: `uvicorn serve:create_app --factory`)
+def create_app():
+    from app import app as flask_app
+    return AdmissionControl(WSGIMiddleware(flask_app, workers=SERVE_THREADS))
+
+
+if __name__ == "__main__":
+    # Separate uvicorn processes would each load a private gallery and append to the
+    # store with their own headers; only the pre-fork mode shares one gallery
+    if SERVE_WORKERS != 1:
+        raise SystemExit("SERVE_WORKERS must be 1; run several workers with `gunicorn -c gunicorn.conf.py` "
+                         "(PREFORK_WORKERS), which shares one gallery between them")
+    import uvicorn
+    uvicorn.run("serve:create_app", factory=True, host=SERVE_HOST, port=SERVE_PORT,
+                timeout_graceful_shutdown=SERVE_DRAIN_TIMEOUT)
@@ -0,0 +1,160 @@
+import json
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+from ann_index import IVFIndex
+from gallery import GallerySnapshot
+
+CONTROL_SIZE = 128  # generation (8 bytes) + name length (8 bytes) + segment name
+SEGMENT_ALIGNMENT = 64
+
+
+# Function to map an existing segment. The resource tracker is started by the parent
+# before forking and shared by all workers, so registrations are not duplicated and a
+# worker exiting never unlinks segments the others are still using.
+def _attach_segment(name):
+    return shared_memory.SharedMemory(name=name)
+
+
+# Function to unlink a segment by name, through our own handle when we created it
+def _unlink_segment(name, owned=None):
+    try:
+        if owned is not None and owned.name == name:
+            owned.unlink()
+        else:
+            _attach_segment(name).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _align(offset):
+    return (offset + SEGMENT_ALIGNMENT - 1) // SEGMENT_ALIGNMENT * SEGMENT_ALIGNMENT
+
+
+class SharedGallery:
+    """Gallery snapshots published to every worker process through shared memory.
+
+    Each published snapshot is one read-only segment holding a JSON header,
+    the embedding matrix (rows grouped by person), the rows per person, the
+    per-person centroids used for matching and, for large galleries, the ANN
+    index arrays. A small control segment holds
+    the current segment name and a generation counter. Publishing writes the
+    new segment first and then flips the control block under an inter-process
+    lock, so workers switch from one complete gallery to the next; they check
+    the generation on each request and map the new segment without copying it.
+
+    Create it in the parent process before the workers are forked, and
+    unlink() it there when the server exits. Each publish unlinks the
+    segment it supersedes.
+    """
+    def __init__(self, control, lock, prefix):
+        self.control = control
+        self.lock = lock      # multiprocessing.Lock shared by all workers: held by writers and attachers
+        self.prefix = prefix
+        self._owned = None    # Segment this process created for its latest publish
+
+    @classmethod
+    def create(cls):
+        prefix = f"face_gallery_{os.getpid()}"
+        control = shared_memory.SharedMemory(name=f"{prefix}_ctl", create=True, size=CONTROL_SIZE)
+        control.buf[:16] = bytes(16)
+        return cls(control, multiprocessing.Lock(), prefix)
+
+    @property
+    def generation(self):
+        """Generation of the latest published snapshot (0 = none yet); cheap enough for every request"""
+        return int.from_bytes(self.control.buf[:8], 'little')
+
+    def _segment_name(self):
+        name_length = int.from_bytes(self.control.buf[8:16], 'little')
+        return bytes(self.control.buf[16:16 + name_length]).decode()
+
+    def publish(self, snapshot):
+        """Publish a snapshot to all workers; call with self.lock held. Returns (shared snapshot, generation)"""
+        arrays = {
+            'matrix': np.ascontiguousarray(snapshot.matrix, dtype=np.float32),
+            'counts': np.ascontiguousarray(snapshot.counts, dtype=np.int64),
+            'centroids': np.ascontiguousarray(snapshot.matcher.centroids, dtype=np.float32)
+        }
+        index = snapshot.matcher.index
+        if index is not None:
+            # The ANN index travels with the gallery so workers never retrain it
+            coarse_centroids, vectors, list_offsets, keys = index.arrays()
+            arrays['indexCentroids'] = np.ascontiguousarray(coarse_centroids, dtype=np.float32)
+            arrays['indexVectors'] = np.ascontiguousarray(vectors, dtype=np.float32)
+            arrays['indexOffsets'] = list_offsets
+            arrays['indexKeys'] = np.array([snapshot.positions[key] for key in keys], dtype=np.int32)
+
+        layout = {}
+        offset = 0
+        for array_name, array in arrays.items():
+            layout[array_name] = [offset, array.dtype.str, list(array.shape)]
+            offset = _align(offset + array.nbytes)
+        header = json.dumps({
+            'version': snapshot.version,
+            'personNames': snapshot.person_names,
+            'indexNprobe': index.nprobe if index is not None else None,
+            'indexVersion': index.version if index is not None else None,
+            'arrays': layout
+        }).encode()
+        data_offset = _align(8 + len(header))
+
+        generation = self.generation + 1
+        name = f"{self.prefix}_{generation}"
+        segment = shared_memory.SharedMemory(name=name, create=True, size=data_offset + offset)
+        segment.buf[:8] = len(header).to_bytes(8, 'little')
+        segment.buf[8:8 + len(header)] = header
+        for array_name, array in arrays.items():
+            target = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf,
+                                offset=data_offset + layout[array_name][0])
+            target[...] = array
+
+        # Flip the control block: name first, generation last
+        previous_name = self._segment_name() if self.generation else None
+        encoded_name = name.encode()
+        self.control.buf[8:16] = len(encoded_name).to_bytes(8, 'little')
+        self.control.buf[16:16 + len(encoded_name)] = encoded_name
+        self.control.buf[:8] = generation.to_bytes(8, 'little')
+
+        # Retire the superseded segment; workers that still map it keep their view until they move on
+        if previous_name is not None:
+            _unlink_segment(previous_name, self._owned)
+        self._owned = segment
+        return self._snapshot_from(segment), generation
+
+    def attach(self):
+        """Map the latest published snapshot; call with self.lock held. Returns (snapshot or None, generation)"""
+        generation = self.generation
+        if generation == 0:
+            return None, 0
+        return self._snapshot_from(_attach_segment(self._segment_name())), generation
+
+    def unlink(self):
+        """Remove the current segment and the control block; call once, in the parent, at shutdown"""
+        if self.generation:
+            _unlink_segment(self._segment_name(), self._owned)
+        self.control.unlink()
+
+    def _snapshot_from(self, segment):
+        header_length = int.from_bytes(segment.buf[:8], 'little')
+        header = json.loads(bytes(segment.buf[8:8 + header_length]))
+        data_offset = _align(8 + header_length)
+
+        arrays = {}
+        for array_name, (offset, dtype, shape) in header['arrays'].items():
+            array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=segment.buf, offset=data_offset + offset)
+            array.flags.writeable = False
+            arrays[array_name] = array
+
+        person_names = header['personNames']
+        index = None
+        if 'indexCentroids' in arrays:
+            keys = [person_names[i] for i in arrays['indexKeys']]
+            index = IVFIndex.from_arrays(arrays['indexCentroids'], arrays['indexVectors'],
+                                         arrays['indexOffsets'], keys, header['indexNprobe'])
+            index.version = header['indexVersion']
+        snapshot = GallerySnapshot(arrays['matrix'], arrays['counts'], person_names, header['version'],
+                                   centroids=arrays['centroids'], index=index)
+        snapshot.shared_memory = segment  # Keeps the segment mapped while the snapshot is in use
+        return snapshot
@@ -1,18 +1,33 @@
+import time
+STARTUP_TIME = time.perf_counter()  # For the cold-start metrics
+
 import cv2
 import os
 import datetime
+import queue
+import threading
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import load_model
-from scipy.spatial.distance import cosine
 import mediapipe as mp
 import h5py
-import time
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, deque
+from matcher import FaceMatcher
+from model_metadata import load_model_metadata
+from preprocessing import Preprocessor
+from detector_pool import detection_input
+from enrollment import decode_image_bytes
+from face_alignment import align_face
+from embedding_cache import model_version
+from known_faces import KnownFacesGallery
+from live_pipeline import LatestSlot, StageTimer, StageWorker
+from track_association import iou_matrix, greedy_assign
 
 # Configuration
 MODEL_FOLDER = 'resnet50_model'
-FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, 'resnet50_face_features.h5')
+FEATURE_MODEL_NAME = 'resnet50'  # Model name written by ready.py, e.g. 'mobilenet_v2_160_128'
+FEATURE_MODEL_PATH = os.path.join(MODEL_FOLDER, f'{FEATURE_MODEL_NAME}_face_features.h5')
+MODEL_METADATA = load_model_metadata(FEATURE_MODEL_PATH)  # Input size and preprocessing for the backbone
 KNOWN_FACES_DIR = 'faces'
 ATTENDANCE_FILE = 'attendance.csv'
 SIMILARITY_THRESHOLD = 0.4  # Adjusted for ResNet50 (higher value means more similar)
@@ -22,10 +37,17 @@ CAMERA_WIDTH = 640
 CAMERA_HEIGHT = 480
 
 # Face recognition settings
-RECOGNITION_INTERVAL = 3  # Process every N frames
 FACE_MEMORY_DURATION = 3.0  # Keep face identities for 3 seconds
 FACE_RECOGNITION_SAMPLES = 5  # Number of samples to average for recognition
 FACE_RECOGNITION_CONFIDENCE = 0.65  # Minimum confidence to update display
+MULTI_FACE_MODE = True  # Recognize every face in the frame (False: only the first detection)
+MULTI_FACE_MIN_CONFIDENCE = 0.5  # Detections below this score are ignored in multi-face mode
+
+# Identity-locked tracking: confirmed faces are followed by detection alone
+TRACK_LOCK_SAMPLES = 3  # Matches needed before a confident identity is locked
+TRACK_REFRESH_INTERVAL = 5.0  # Seconds between re-checks of a locked identity
+TRACK_SUSPECT_GAP = 0.5  # A face unseen for this long is re-checked when it reappears
+TRACK_SUSPECT_IOU = 0.3  # A box overlapping its previous position less than this is re-checked
 
 # Create attendance file if it doesn't exist
 if not os.path.exists(ATTENDANCE_FILE):
@@ -55,49 +77,8 @@ face_detection = mp_face_detection.FaceDetection(
     min_detection_confidence=0.5
 )
 
-# Function to perform face alignment using eye centers
-def align_face(image, landmarks):
-    # Extract eye landmarks (MediaPipe provides normalized coordinates)
-    h, w, _ = image.shape
-    
-    # Convert to absolute coordinates (rough estimate from MediaPipe landmarks)
-    left_eye_x = int(landmarks.location_data.relative_keypoints[0].x * w)
-    left_eye_y = int(landmarks.location_data.relative_keypoints[0].y * h)
-    right_eye_x = int(landmarks.location_data.relative_keypoints[1].x * w)
-    right_eye_y = int(landmarks.location_data.relative_keypoints[1].y * h)
-    
-    # Calculate angle
-    dx = right_eye_x - left_eye_x
-    dy = right_eye_y - left_eye_y
-    angle = np.degrees(np.arctan2(dy, dx))
-    
-    # Get rotation matrix
-    center = ((left_eye_x + right_eye_x) // 2, (left_eye_y + right_eye_y) // 2)
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, scale=1.0)
-    
-    # Apply rotation
-    aligned_image = cv2.warpAffine(image, rotation_matrix, (w, h), flags=cv2.INTER_CUBIC)
-    
-    return aligned_image
-
-# Function to preprocess image for ResNet50 model
-def preprocess_image(img):
-    # Resize to 224x224 (ResNet input size)
-    resized = cv2.resize(img, (224, 224))
-    # Convert from BGR to RGB (OpenCV uses BGR, but model expects RGB)
-    rgb_img = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    
-    # Convert to float32 BEFORE subtraction
-    bgr_img = rgb_img[..., ::-1].copy().astype(np.float32)
-    
-    # Zero-center by mean pixel values
-    bgr_img[..., 0] -= 91.4953
-    bgr_img[..., 1] -= 103.8827
-    bgr_img[..., 2] -= 131.0912
-    
-    # Add batch dimension
-    preprocessed = np.expand_dims(bgr_img, axis=0)
-    return preprocessed
+# Preprocessing for the feature model (input size and normalization from MODEL_METADATA)
+preprocess_image = Preprocessor(MODEL_METADATA)
 
 # Function to extract face embeddings using ResNet50 model
 def extract_resnet_features(face_img):
@@ -105,18 +86,8 @@ def extract_resnet_features(face_img):
     features = resnet_feature_model.predict(preprocessed, verbose=0)
     return features[0]  # Return the feature vector
 
-# Function to detect face using MediaPipe and return cropped face
-def detect_and_crop_face(image):
-    # Convert the BGR image to RGB
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    # Process the image
-    results = face_detection.process(rgb_image)
-    
-    if not results.detections:
-        return None, None
-    
-    # Get the first detected face
-    detection = results.detections[0]
+# Function to get the pixel bounding box (x, y, w, h) of one MediaPipe detection
+def detection_bbox(image, detection):
     bboxC = detection.location_data.relative_bounding_box
     
     # Convert normalized coordinates to absolute pixel values
@@ -131,61 +102,92 @@ def detect_and_crop_face(image):
     y = max(0, y)
     w = min(w, iw - x)
     h = min(h, ih - y)
+    return x, y, w, h
+
+# Function to crop and align one MediaPipe detection
+def crop_detection(image, detection):
+    x, y, w, h = detection_bbox(image, detection)
     
     # Crop the face
     face_img = image[y:y+h, x:x+w]
     
-    # Try to align the face if landmarks are available
-    try:
-        aligned_face = align_face(image, detection)
-        # Re-crop the aligned face using the same boundaries
-        aligned_face_crop = aligned_face[y:y+h, x:x+w]
-        if aligned_face_crop.size > 0:
-            face_img = aligned_face_crop
-    except Exception as e:
-        print(f"Warning: Face alignment failed: {e}")
+    # Try to align the face if landmarks are available: rotate, crop and resize to
+    # the model input size in one warp over the output pixels only
+    if face_img.size > 0:
+        try:
+            face_img = align_face(image, detection, (x, y, w, h), MODEL_METADATA['input_size'])
+        except Exception as e:
+            print(f"Warning: Face alignment failed: {e}")
     
     return face_img, (x, y, w, h)
 
-# Load known faces and compute their embeddings
-print("Loading known faces and computing embeddings...")
-known_faces = {}
-attended_persons = set()  # To avoid duplicate attendance entries
+# Function to detect face using MediaPipe and return cropped face
+def detect_and_crop_face(image, detector=None):
+    # Convert the BGR image to a downscaled RGB copy for detection; cropping uses the full image
+    rgb_image = detection_input(image)
+    # Process the image (other threads pass their own detector; graphs are not thread-safe)
+    results = (detector or face_detection).process(rgb_image)
+    
+    if not results.detections:
+        return None, None
+    
+    # Get the first detected face
+    return crop_detection(image, results.detections[0])
 
-# Process each person's directory
-for person_name in os.listdir(KNOWN_FACES_DIR):
-    person_path = os.path.join(KNOWN_FACES_DIR, person_name)
-    if os.path.isdir(person_path):
-        known_faces[person_name] = []
-        print(f"Processing images for: {person_name}")
-        
-        # Process each image in the person's directory
-        for img_name in os.listdir(person_path):
-            if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-                img_path = os.path.join(person_path, img_name)
-                try:
-                    # Load image
-                    img = cv2.imread(img_path)
-                    if img is None:
-                        print(f"Could not read image: {img_path}")
-                        continue
-                    
-                    # Detect and crop face using MediaPipe
-                    face_img, face_coords = detect_and_crop_face(img)
-                    
-                    if face_img is not None and face_img.size > 0:
-                        # Extract features and store
-                        embedding = extract_resnet_features(face_img)
-                        known_faces[person_name].append(embedding)
-                        print(f"  Processed: {img_name}")
-                    else:
-                        print(f"  No face detected in: {img_name}")
-                
-                except Exception as e:
-                    print(f"  Error processing {img_path}: {str(e)}")
+# Function to detect every face above a confidence threshold (detections only, no crops)
+def detect_faces(image, detector=None, min_confidence=MULTI_FACE_MIN_CONFIDENCE):
+    rgb_image = detection_input(image)
+    results = (detector or face_detection).process(rgb_image)
+    return [detection for detection in results.detections or [] if detection.score[0] >= min_confidence]
+
+
+# Function to embed several face crops in one forward pass
+def extract_resnet_features_batch(face_imgs):
+    preprocessed = preprocess_image.batch_buffer(len(face_imgs))
+    for row, face_img in zip(preprocessed, face_imgs):
+        preprocess_image.into(face_img, row)
+    return resnet_feature_model.predict(preprocessed, verbose=0)
+
+# Function to embed one known-face image file (None if no face is found)
+def embed_known_face(img_path, detector=None):
+    # Large JPEGs are decoded at reduced scale
+    with open(img_path, 'rb') as f:
+        img = decode_image_bytes(f.read())
+    if img is None:
+        print(f"Could not read image: {img_path}")
+        return None
+    
+    # Detect and crop face using MediaPipe
+    face_img, face_coords = detect_and_crop_face(img, detector)
+    if face_img is None or face_img.size == 0:
+        return None
+    
+    # Extract features
+    return extract_resnet_features(face_img)
+
+# Load the saved known-face gallery and embed only new or changed images
+print("Loading known faces gallery...")
+attended_persons = set()  # To avoid duplicate attendance entries
+known_faces_gallery = KnownFacesGallery(KNOWN_FACES_DIR, model_version(FEATURE_MODEL_PATH))
+known_faces_gallery.sync(embed_known_face)
+known_faces = known_faces_gallery.known_faces()
 
 print(f"Loaded embeddings for {len(known_faces)} persons")
 
+# Build the vectorized matcher over all known embeddings
+face_matcher = FaceMatcher.from_dict(known_faces)
+
+# Function to swap in a new matcher when the known faces directory changes
+def on_known_faces_changed(updated_faces):
+    global face_matcher
+    face_matcher = FaceMatcher.from_dict(updated_faces)
+    print(f"Known faces updated: {len(updated_faces)} persons")
+
+# Watch the known faces directory with a dedicated detector for the watcher thread
+watcher_face_detection = mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5)
+known_faces_gallery.start_watching(lambda img_path: embed_known_face(img_path, watcher_face_detection),
+                                   on_known_faces_changed)
+
 # Function to mark attendance
 def mark_attendance(name):
     if name not in attended_persons:
@@ -205,105 +207,129 @@ class FaceTracker:
         self.face_records = {}  # Stores recognized faces and their history
         self.face_history = {}  # Stores recognition history for each detected face
         self.last_seen = {}     # Stores when each face was last seen
+        self.last_recognized = {}  # Stores when each face was last embedded and matched
+        self.suspect = set()    # Faces whose locked identity must be re-checked
+        self.next_face_number = 1  # Face IDs are never reused, even after a face is cleaned up
         self.current_time = datetime.datetime.now().timestamp()
+        # The detection worker observes boxes while the display loop reads and applies results
+        self._lock = threading.Lock()
         
     def update_time(self):
         self.current_time = datetime.datetime.now().timestamp()
         
-    def _get_face_id(self, bbox, prev_faces):
-        """Generate a unique ID for a face based on its position"""
-        x, y, w, h = bbox
-        center = (x + w/2, y + h/2)
-        
-        # Check if this face matches an existing face by position
-        for face_id, face_bbox in prev_faces.items():
-            prev_x, prev_y, prev_w, prev_h = face_bbox
-            prev_center = (prev_x + prev_w/2, prev_y + prev_h/2)
-            
-            # Calculate distance between centers
-            distance = np.sqrt((center[0] - prev_center[0])**2 + (center[1] - prev_center[1])**2)
-            
-            # If centers are close enough, it's the same face
-            if distance < (w + prev_w) / 4:  # Threshold based on face size
-                return face_id
-        
-        # If no match found, generate a new ID
-        return f"face_{len(prev_faces) + 1}"
+    def _new_face_id(self):
+        face_id = f"face_{self.next_face_number}"
+        self.next_face_number += 1
+        return face_id
     
     def clean_old_faces(self):
         """Remove faces that haven't been seen recently"""
-        to_remove = []
-        for face_id, last_time in self.last_seen.items():
-            if self.current_time - last_time > FACE_MEMORY_DURATION:
-                to_remove.append(face_id)
-        
-        for face_id in to_remove:
-            if face_id in self.face_records:
-                del self.face_records[face_id]
-            if face_id in self.face_history:
-                del self.face_history[face_id]
-            if face_id in self.last_seen:
-                del self.last_seen[face_id]
-    
-    def update_face(self, bbox, name, similarity):
-        """Update face recognition data"""
-        # Get current face positions
-        current_face_positions = {face_id: data['bbox'] for face_id, data in self.face_records.items()}
-        
-        # Get face ID
-        face_id = self._get_face_id(bbox, current_face_positions)
-        
-        # Update last seen time
-        self.last_seen[face_id] = self.current_time
-        
-        # Update face history
-        if face_id not in self.face_history:
-            self.face_history[face_id] = []
-        
-        # Add new recognition to history
-        self.face_history[face_id].append((name, similarity))
-        
-        # Keep only the most recent samples
-        if len(self.face_history[face_id]) > FACE_RECOGNITION_SAMPLES:
-            self.face_history[face_id].pop(0)
-        
-        # Get the most common name from history
-        names = [n for n, _ in self.face_history[face_id]]
-        name_counts = Counter(names)
-        most_common_name, count = name_counts.most_common(1)[0]
-        
-        # Calculate confidence as the proportion of this name in the history
-        confidence = count / len(self.face_history[face_id])
-        
-        # Only update the display name if confidence is high enough
-        if confidence >= FACE_RECOGNITION_CONFIDENCE:
-            # Calculate average similarity for this name
-            avg_similarity = np.mean([s for n, s in self.face_history[face_id] if n == most_common_name])
+        with self._lock:
+            to_remove = []
+            for face_id, last_time in self.last_seen.items():
+                if self.current_time - last_time > FACE_MEMORY_DURATION:
+                    to_remove.append(face_id)
             
-            # Update face record
-            self.face_records[face_id] = {
-                'name': most_common_name,
-                'similarity': avg_similarity,
-                'bbox': bbox,
-                'confidence': confidence
-            }
-        elif face_id not in self.face_records:
-            # If we don't have a confident name yet, show as "Identifying..."
-            self.face_records[face_id] = {
-                'name': "Identifying...",
-                'similarity': 0,
-                'bbox': bbox,
-                'confidence': 0
-            }
-        else:
-            # Just update the position
-            self.face_records[face_id]['bbox'] = bbox
-        
-        return face_id
+            for face_id in to_remove:
+                self.face_records.pop(face_id, None)
+                self.face_history.pop(face_id, None)
+                self.last_seen.pop(face_id, None)
+                self.last_recognized.pop(face_id, None)
+                self.suspect.discard(face_id)
+    
+    def observe(self, bboxes):
+        """Follow detected boxes without recognizing them; returns the face ID of each box"""
+        with self._lock:
+            now = datetime.datetime.now().timestamp()
+            track_ids = list(self.face_records)
+            
+            # Score every detection against every track at once and assign globally
+            ious = iou_matrix(bboxes, [self.face_records[face_id]['bbox'] for face_id in track_ids])
+            matches, unmatched = greedy_assign(ious)
+            
+            face_ids = [None] * len(bboxes)
+            for det_idx, track_idx in matches:
+                face_id = track_ids[track_idx]
+                # A face that jumped or reappeared after a gap may be someone else
+                if (now - self.last_seen[face_id] > TRACK_SUSPECT_GAP
+                        or ious[det_idx, track_idx] < TRACK_SUSPECT_IOU):
+                    if face_id not in self.suspect:
+                        self.suspect.add(face_id)
+                        self.face_history.pop(face_id, None)  # Let new samples decide
+                self.face_records[face_id]['bbox'] = bboxes[det_idx]
+                face_ids[det_idx] = face_id
+            
+            for det_idx in unmatched:
+                # New face: show as "Identifying..." until it has been recognized
+                face_id = self._new_face_id()
+                self.face_records[face_id] = {
+                    'name': "Identifying...",
+                    'similarity': 0,
+                    'bbox': bboxes[det_idx],
+                    'confidence': 0
+                }
+                face_ids[det_idx] = face_id
+            
+            for face_id in face_ids:
+                self.last_seen[face_id] = now
+            return face_ids
+    
+    def needs_recognition(self, face_id):
+        """Whether a face must be embedded: new or unconfirmed, suspect, or due for a refresh"""
+        with self._lock:
+            record = self.face_records.get(face_id)
+            history = self.face_history.get(face_id, [])
+            locked = (record is not None and record['name'] != "Identifying..."
+                      and record['confidence'] >= FACE_RECOGNITION_CONFIDENCE
+                      and len(history) >= TRACK_LOCK_SAMPLES)
+            if not locked or face_id in self.suspect:
+                return True
+            now = datetime.datetime.now().timestamp()
+            return now - self.last_recognized.get(face_id, 0) > TRACK_REFRESH_INTERVAL
+    
+    def update_face(self, face_id, name, similarity):
+        """Update face recognition data for an observed face"""
+        with self._lock:
+            # The face may have been cleaned up while it was being recognized
+            if face_id not in self.face_records:
+                return None
+            
+            self.last_recognized[face_id] = self.current_time
+            self.suspect.discard(face_id)
+            
+            # Update face history (a ring buffer of the most recent samples)
+            if face_id not in self.face_history:
+                self.face_history[face_id] = deque(maxlen=FACE_RECOGNITION_SAMPLES)
+            
+            # Add new recognition to history
+            self.face_history[face_id].append((name, similarity))
+            
+            # Get the most common name from history
+            names = [n for n, _ in self.face_history[face_id]]
+            name_counts = Counter(names)
+            most_common_name, count = name_counts.most_common(1)[0]
+            
+            # Calculate confidence as the proportion of this name in the history
+            confidence = count / len(self.face_history[face_id])
+            
+            # Only update the display name if confidence is high enough
+            if confidence >= FACE_RECOGNITION_CONFIDENCE:
+                # Calculate average similarity for this name
+                avg_similarity = np.mean([s for n, s in self.face_history[face_id] if n == most_common_name])
+                
+                # Update face record
+                self.face_records[face_id].update({
+                    'name': most_common_name,
+                    'similarity': avg_similarity,
+                    'confidence': confidence
+                })
+            
+            return face_id
     
     def get_face_records(self):
-        """Get the current face records"""
-        return self.face_records
+        """Get a copy of the current face records"""
+        with self._lock:
+            return {face_id: dict(record) for face_id, record in self.face_records.items()}
 
 # Initialize webcam with higher resolution
 print("Starting webcam with high resolution...")
@@ -323,25 +349,80 @@ actual_height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
 actual_fps = cap.get(cv2.CAP_PROP_FPS)
 print(f"Camera initialized at {int(actual_width)}x{int(actual_height)} @ {int(actual_fps)}fps")
 
+print(f"Cold start to camera ready: {time.perf_counter() - STARTUP_TIME:.2f}s")
 print("Press 'q' to quit the application")
 
-# Initialize face tracker
+# Initialize face tracker (the detection worker follows faces, the display loop applies results)
 face_tracker = FaceTracker()
 
-# Main loop for face recognition
-frame_count = 0
+# Pipeline stages: capture -> detection -> embedding/matching, connected by
+# latest-wins slots so each stage always works on the freshest frame and the
+# display loop runs at camera rate regardless of inference speed
+stop_event = threading.Event()
+stage_timer = StageTimer()
+display_slot = LatestSlot()    # Latest frame for the display loop
+detection_slot = LatestSlot()  # Latest frame for the detection worker
+embedding_slot = LatestSlot()  # Latest detected faces for the embedding worker
+recognition_results = queue.Queue()  # Match results, applied to the tracker by the display loop
+
+# Function to keep grabbing frames so the camera buffer never holds stale ones
+def capture_frames():
+    while not stop_event.is_set():
+        capture_start_time = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            print("Error: Failed to capture image from webcam")
+            stop_event.set()
+            break
+        stage_timer.record('capture', time.perf_counter() - capture_start_time)
+        display_slot.put(frame)
+        detection_slot.put(frame)
+
+# Detection stage: follow the faces in the latest frame and crop only those that
+# need recognition, so locked identities cost a detection and no embedding
+def detect_stage(frame):
+    detections = detect_faces(frame)
+    if not MULTI_FACE_MODE:
+        detections = detections[:1]
+    face_ids = face_tracker.observe([detection_bbox(frame, detection) for detection in detections])
+    
+    faces = []
+    for face_id, detection in zip(face_ids, detections):
+        if face_tracker.needs_recognition(face_id):
+            face_img, _ = crop_detection(frame, detection)
+            if face_img.size > 0:
+                faces.append((face_id, face_img))
+    if faces:
+        embedding_slot.put(faces)
+
+# Embedding stage: embed all face crops in one batch and match them in one matrix multiply
+def embed_stage(faces):
+    embeddings = extract_resnet_features_batch([face_img for _, face_img in faces])
+    matches = face_matcher.match_batch(embeddings, SIMILARITY_THRESHOLD)
+    recognition_results.put([(face_id, best_match, best_similarity)
+                             for (face_id, _), (best_match, best_similarity, _) in zip(faces, matches)])
+
+capture_thread = threading.Thread(target=capture_frames, name="capture", daemon=True)
+pipeline_threads = [
+    capture_thread,
+    StageWorker('detect', detection_slot, detect_stage, stage_timer, stop_event),
+    StageWorker('embed', embedding_slot, embed_stage, stage_timer, stop_event)
+]
+for thread in pipeline_threads:
+    thread.start()
+
+# Main loop for display
 notification_time = 0
 notification_text = ""
-last_process_time = time.time()
 fps_update_time = time.time()
 fps_counter = 0
 fps_display = 0
+first_result_logged = False
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Error: Failed to capture image from webcam")
-        break
+while not stop_event.is_set():
+    frame = display_slot.get(timeout=1.0)
+    if frame is None:
+        continue
     
     current_time = time.time()
     fps_counter += 1
@@ -358,20 +439,38 @@ while True:
     # Clean old faces
     face_tracker.clean_old_faces()
     
-    frame_count += 1
+    # Apply the recognition results produced since the last displayed frame
+    while True:
+        try:
+            frame_results = recognition_results.get_nowait()
+        except queue.Empty:
+            break
+        if not first_result_logged:
+            print(f"Cold start to first result: {time.perf_counter() - STARTUP_TIME:.2f}s")
+            first_result_logged = True
+        
+        for face_id, best_match, best_similarity in frame_results:
+            # Update face tracker with the new recognition
+            face_id = face_tracker.update_face(face_id, best_match, best_similarity)
+            
+            # Only mark attendance if this is a confirmed face (not "Identifying..." or "Unknown")
+            face_data = face_tracker.get_face_records().get(face_id)
+            if face_data and face_data['name'] != "Identifying..." and face_data['name'] != "Unknown":
+                # Mark attendance only if confidence is high enough after multiple detections
+                if face_data['confidence'] >= FACE_RECOGNITION_CONFIDENCE and mark_attendance(face_data['name']):
+                    notification_text = f"Attendance marked for {face_data['name']}"
+                    notification_time = current_time
+    
     display_frame = frame.copy()
     
     # Clear old notifications (display for 3 seconds)
     if notification_text and current_time - notification_time > 3.0:
         notification_text = ""
-
-    # Process frames at a reduced rate to decrease CPU load
-    process_this_frame = (frame_count % RECOGNITION_INTERVAL == 0)
     
     # Get existing face records
     face_records = face_tracker.get_face_records()
     
-    # Display existing tracked faces (do this for every frame)
+    # Display tracked faces
     for face_id, face_data in face_records.items():
         x, y, w, h = face_data['bbox']
         name = face_data['name']
@@ -403,59 +502,12 @@ while True:
         cv2.putText(display_frame, display_text, (text_x, y+h+20), 
                     cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
     
-    # Only process every Nth frame to reduce CPU load
-    if process_this_frame:
-        processing_start_time = time.time()
-        
-        # Detect and process face in current frame
-        face_img, face_coords = detect_and_crop_face(frame)
-        
-        if face_img is not None and face_img.size > 0 and face_coords is not None:
-            x, y, w, h = face_coords
-            
-            # Extract face features
-            try:
-                embedding = extract_resnet_features(face_img)
-                
-                # Compare with known faces
-                best_match = "Unknown"
-                best_similarity = 0
-                
-                for person_name, known_embeddings in known_faces.items():
-                    if not known_embeddings:
-                        continue
-                    
-                    # Calculate cosine similarity with all known embeddings for this person
-                    similarities = [1 - cosine(embedding, known_emb) for known_emb in known_embeddings]
-                    avg_similarity = np.mean(similarities)
-                    
-                    # Update best match if this person is more similar
-                    if avg_similarity > best_similarity and avg_similarity > SIMILARITY_THRESHOLD:
-                        best_similarity = avg_similarity
-                        best_match = person_name
-                
-                # Update face tracker with new detection
-                face_id = face_tracker.update_face(face_coords, best_match, best_similarity)
-                
-                # Only mark attendance if this is a confirmed face (not "Identifying..." or "Unknown")
-                face_data = face_tracker.get_face_records().get(face_id)
-                if face_data and face_data['name'] != "Identifying..." and face_data['name'] != "Unknown":
-                    # Mark attendance only if confidence is high enough after multiple detections
-                    if face_data['confidence'] >= FACE_RECOGNITION_CONFIDENCE and mark_attendance(face_data['name']):
-                        notification_text = f"Attendance marked for {face_data['name']}"
-                        notification_time = current_time
-            
-            except Exception as e:
-                print(f"Error processing face: {str(e)}")
-        
-        # Measure and report processing time
-        processing_time = time.time() - processing_start_time
-        if processing_time > 0.1:  # Only log if processing takes significant time
-            print(f"Frame processing time: {processing_time:.3f}s")
-    
-    # Display FPS
+    # Display FPS and per-stage timings
     cv2.putText(display_frame, f"FPS: {fps_display}", (10, 30), 
                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    for i, (stage, stage_ms) in enumerate(sorted(stage_timer.snapshot().items())):
+        cv2.putText(display_frame, f"{stage}: {stage_ms:.1f} ms", (10, 55 + i * 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
     
     # Display notification if available
     if notification_text:
@@ -480,7 +532,11 @@ while True:
     if cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
-# Release resources
+# Stop the pipeline and release resources
+stop_event.set()
+known_faces_gallery.stop_watching()
+for thread in pipeline_threads:
+    thread.join(timeout=2.0)
 cap.release()
 cv2.destroyAllWindows()
-print("Application closed")
\ No newline at end of file
+print("Application closed")
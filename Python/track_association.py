@@ -0,0 +1,45 @@
+import numpy as np
+
+TRACK_MATCH_MIN_IOU = 0.2  # Detections overlapping a track less than this start a new track
+
+
+# Function to compute the (N, M) IoU matrix between N and M (x, y, w, h) boxes
+def iou_matrix(boxes_a, boxes_b):
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    a_x2 = a[:, 0] + a[:, 2]
+    a_y2 = a[:, 1] + a[:, 3]
+    b_x2 = b[:, 0] + b[:, 2]
+    b_y2 = b[:, 1] + b[:, 3]
+
+    inter_w = np.clip(np.minimum(a_x2[:, None], b_x2[None, :]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a_y2[:, None], b_y2[None, :]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    intersection = inter_w * inter_h
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+# Function to assign detections to tracks greedily by descending IoU.
+# Returns ([(detection_idx, track_idx)], unmatched detection indices).
+def greedy_assign(ious, min_iou=TRACK_MATCH_MIN_IOU):
+    num_detections, num_tracks = ious.shape
+    matches = []
+    if num_detections and num_tracks:
+        # Visit every candidate pair once, best overlap first
+        order = np.argsort(-ious, axis=None, kind='stable')
+        detection_used = np.zeros(num_detections, dtype=bool)
+        track_used = np.zeros(num_tracks, dtype=bool)
+        for flat_idx in order:
+            det_idx, track_idx = divmod(int(flat_idx), num_tracks)
+            if ious[det_idx, track_idx] < min_iou:
+                break
+            if detection_used[det_idx] or track_used[track_idx]:
+                continue
+            detection_used[det_idx] = True
+            track_used[track_idx] = True
+            matches.append((det_idx, track_idx))
+            if len(matches) == min(num_detections, num_tracks):
+                break
+    matched = {det_idx for det_idx, _ in matches}
+    unmatched = [det_idx for det_idx in range(num_detections) if det_idx not in matched]
+    return matches, unmatched
@@ -15,6 +15,7 @@ const Take_Attendance = () => {
   const [successMessage, setSuccessMessage] = useState('');
   const [errorMessage, setErrorMessage] = useState('');
   const [embeddings, setEmbeddings] = useState(null);
+  const [galleryVersion, setGalleryVersion] = useState(null);
   const [isLoadingEmbeddings, setIsLoadingEmbeddings] = useState(false);
   const [stats, setStats] = useState({
     totalStudents: 0,
@@ -143,6 +144,7 @@ const Take_Attendance = () => {
       });
       
       const generatedEmbeddings = processResponse.data.embeddings;
+      setGalleryVersion(processResponse.data.galleryVersion || null);
       
       // 4. Save embeddings to MongoDB
       await axios.post('http://localhost:5000/api/embeddings/save', {
@@ -264,11 +266,44 @@ const Take_Attendance = () => {
         throw new Error("Failed to capture image from camera");
       }
       
-      // 2. Send frame to Flask backend for recognition
-      const response = await axios.post('http://localhost:5001/api/recognize-face', {
-        image: imageData,
-        embeddings: embeddings
-      });
+      // 2. Send frame to Flask backend for recognition (the gallery lives on the server)
+      let response;
+      try {
+        response = await axios.post('http://localhost:5001/api/recognize-face', {
+          image: imageData,
+          galleryVersion: galleryVersion
+        });
+      } catch (error) {
+        if (!error.response || error.response.status !== 409) {
+          throw error;
+        }
+        let serverVersion = error.response.data.galleryVersion;
+        if (!serverVersion) {
+          // Server gallery is empty (e.g. after a restart): seed it with our embeddings.
+          // The server refuses if another client has loaded a gallery in the meantime
+          try {
+            response = await axios.post('http://localhost:5001/api/recognize-face', {
+              image: imageData,
+              embeddings: embeddings
+            });
+          } catch (seedError) {
+            if (!seedError.response || seedError.response.status !== 409) {
+              throw seedError;
+            }
+            serverVersion = seedError.response.data.galleryVersion;
+          }
+        }
+        if (!response) {
+          // Server has a different gallery version: never overwrite it with ours,
+          // refresh our copy and recognize against the server's version instead
+          loadEmbeddings();
+          response = await axios.post('http://localhost:5001/api/recognize-face', {
+            image: imageData,
+            galleryVersion: serverVersion
+          });
+        }
+      }
+      setGalleryVersion(response.data.galleryVersion || null);
       
       // 3. Handle recognition result
       const result = response.data;